@@ -1,14 +1,32 @@
 import tempfile
 
 import pytest
+from django.core.cache import cache
 from mixer.backend.django import mixer as _mixer
 from posts.models import Post, Group
+from yatube.testing import isolated_caches
+
+
+@pytest.fixture(scope="session", autouse=True)
+def isolated_cache():
+    with isolated_caches():
+        yield
+
+
+@pytest.fixture(autouse=True)
+def clear_cache(isolated_cache):
+    # Кэш сбрасывается после коммита, а тесты свои транзакции
+    # откатывают: страница прошлого теста иначе осталась бы в кэше.
+    cache.clear()
 
 
 @pytest.fixture()
 def mock_media(settings):
     with tempfile.TemporaryDirectory() as temp_directory:
         settings.MEDIA_ROOT = temp_directory
+        # Миниатюры готовятся сразу, чтобы фоновые потоки не писали
+        # во временный каталог, пока он удаляется.
+        settings.THUMBNAIL_WORKERS = 0
         yield temp_directory
 
 
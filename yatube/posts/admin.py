@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from .models import Post, Group, Comment, Follow
+from .search import filter_matching
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -15,6 +16,11 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ("pub_date",)
     empty_value_display = "-пусто-"
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return filter_matching(queryset, search_term), False
+
 
 admin.site.register(Post, PostAdmin)
 
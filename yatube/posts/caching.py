@@ -0,0 +1,365 @@
+import hashlib
+import math
+import random
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils import translation
+from django.utils.cache import patch_cache_control
+from django.utils.safestring import mark_safe
+from django.views.decorators.http import condition
+
+from .holes import fill_holes, is_punching
+from .thumbnails import resolve as resolve_thumbnails
+
+FEED_VERSION_KEY = "posts-feed-version"
+POST_CARD_VERSION_KEY = "post-card-version-{}"
+POST_CARD_KEY = "post-card-{}-{}"
+PAGE_KEY = "page-{}-{}"
+PAGE_TAG_VERSION_KEY = "page-tag-version-{}"
+# Метка, которой помечены все страницы общего кэша.
+ALL_PAGES_TAG = "pages"
+
+OWNER_BLOCK = re.compile(
+    r"<!--owner:(?P<owner>\d+)-->(?P<body>.*?)<!--/owner-->", re.S
+)
+
+
+def initial_version():
+    # Начинаем со времени, чтобы после вытеснения ключа версия
+    # не совпала с одной из уже использованных.
+    return time.time_ns() // 1000
+
+
+def feed_version():
+    """Текущая версия лент; меняется при любом изменении постов."""
+    version = cache.get(FEED_VERSION_KEY)
+    if version is None:
+        cache.add(FEED_VERSION_KEY, initial_version(), timeout=None)
+        version = cache.get(FEED_VERSION_KEY)
+    return version
+
+
+def bump_feed_version():
+    # Версии меняются только после коммита: иначе параллельный запрос
+    # успеет закэшировать под новой версией еще старые данные.
+    transaction.on_commit(incr_feed_version)
+
+
+def incr_feed_version():
+    try:
+        cache.incr(FEED_VERSION_KEY)
+    except ValueError:
+        feed_version()
+
+
+def index_cache_key(page_number, cursor):
+    # Версия ленты хранится в самой записи, чтобы при ее смене
+    # можно было отдать прежнюю страницу, пока новая готовится.
+    return f"index-page-{page_number}-{cursor}"
+
+
+def get_or_compute(key, compute, timeout, version=None):
+    """Значение из кэша, пересчитываемое одним запросом за раз.
+
+    Запись устаревает, когда истек ``timeout`` или сменилась
+    ``version``. Пересчитывает ее только запрос, взявший аренду
+    ``<key>:lease``; остальные в это время получают устаревшее значение.
+    Если значения нет совсем, они недолго ждут результат арендатора.
+    Незадолго до истечения запись случайно пересчитывается заранее
+    (XFetch): чем дороже пересчет, тем раньше.
+    """
+    entry = cache.get(key)
+    if entry is not None and entry["version"] == version:
+        early = entry["delta"] * math.log(1 - random.random())
+        if time.time() - early < entry["expires"]:
+            return entry["value"]
+    lease_key = f"{key}:lease"
+    token = uuid.uuid4().hex
+    if cache.add(lease_key, token, settings.CACHE_LEASE_TIMEOUT):
+        try:
+            return store_computed(key, compute, timeout, version)
+        finally:
+            if cache.get(lease_key) == token:
+                cache.delete(lease_key)
+    if entry is not None:
+        return entry["value"]
+    deadline = time.monotonic() + settings.CACHE_LEASE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None and entry["version"] == version:
+            return entry["value"]
+    # Арендатор не успел: считаем сами, чтобы не держать запрос.
+    return store_computed(key, compute, timeout, version)
+
+
+def store_computed(key, compute, timeout, version):
+    started = time.time()
+    value = compute()
+    now = time.time()
+    cache.set(key, {
+        "value": value,
+        "version": version,
+        "delta": now - started,
+        "expires": now + timeout,
+    }, timeout=timeout + settings.CACHE_STALE_TIMEOUT)
+    return value
+
+
+class UncacheablePage(Exception):
+    """Ответ представления нельзя отдавать другим пользователям."""
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+def page_cache_key(request):
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return PAGE_KEY.format(url, translation.get_language())
+
+
+def is_cacheable(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get("CSRF_COOKIE_USED")
+    )
+
+
+@contextmanager
+def shared_render(request):
+    """Рисует страницу как для гостя, оставляя метки на месте дыр."""
+    user = request.user
+    request.user = AnonymousUser()
+    request.punch_holes = True
+    try:
+        yield
+    finally:
+        request.user = user
+        request.punch_holes = False
+
+
+def page_viewer(request):
+    """Для кого рисуются карточки: None, если страница общая."""
+    return None if is_punching(request) else request.user
+
+
+def cache_shared_page(*tags):
+    """Кэширует страницу целиком, одну на всех пользователей.
+
+    Страница рисуется как для гостя, но куски, зависящие от
+    пользователя, — навигация, кнопки подписки и редактирования, форма
+    комментария — остаются метками. После чтения из кэша метки
+    заполняются для текущего пользователя.
+
+    Ключ зависит от адреса с параметрами запроса и от языка. Метки
+    ``tags`` — шаблоны с аргументами представления, например
+    ``"group:{slug}"``; запись действительна, пока не сменилась версия
+    ни одной из ее меток. Запросы кроме GET и HEAD идут мимо кэша.
+
+    Те же версии меток служат валидаторами ETag и Last-Modified, так что
+    304 отдается до обращения к базе и шаблонам. Last-Modified
+    не зависит от пользователя и поэтому отдается только гостям.
+    """
+    def decorator(view):
+        def etag(request, *args, **kwargs):
+            return page_etag(request, page_versions(request, tags, kwargs))
+
+        def last_modified(request, *args, **kwargs):
+            return page_last_modified(
+                request, page_versions(request, tags, kwargs)
+            )
+
+        @condition(etag_func=etag, last_modified_func=last_modified)
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+
+            def render_page():
+                with shared_render(request):
+                    response = view(request, *args, **kwargs)
+                if not is_cacheable(request, response):
+                    raise UncacheablePage(response)
+                return {
+                    "content": response.content,
+                    "content_type": response["Content-Type"],
+                }
+
+            try:
+                page = get_or_compute(
+                    page_cache_key(request),
+                    render_page,
+                    settings.PAGE_CACHE_TIMEOUT,
+                    version=page_versions(request, tags, kwargs),
+                )
+                response = HttpResponse(
+                    page["content"], content_type=page["content_type"]
+                )
+            except UncacheablePage as error:
+                response = error.response
+            return fill_page(response, request)
+        return wrapper
+    return decorator
+
+
+def fill_page(response, request):
+    """Дорисовывает общую страницу для пользователя ``request``."""
+    if not response.streaming:
+        html = response.content.decode(response.charset)
+        response.content = personalize(
+            fill_holes(html, request), request.user
+        )
+    # Страница своя у каждого пользователя и проверяется
+    # при каждом показе: валидаторы делают это дешевым.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def page_tag_versions(tags):
+    keys = [PAGE_TAG_VERSION_KEY.format(tag) for tag in tags]
+    versions = get_versions(keys)
+    return tuple(versions[key] for key in keys)
+
+
+def page_versions(request, tags, kwargs):
+    """Версии меток страницы, одни на весь запрос."""
+    if getattr(request, "page_versions", None) is None:
+        page_tags = [ALL_PAGES_TAG]
+        page_tags += [tag.format(**kwargs) for tag in tags]
+        request.page_versions = page_tag_versions(page_tags)
+    return request.page_versions
+
+
+def page_etag(request, versions):
+    # Дыры заполняются для пользователя, а форма комментария несет
+    # токен CSRF его сессии, поэтому оба входят в ETag: после
+    # повторного входа старая форма из кэша браузера не пройдет проверку.
+    payload = (
+        f"{request.build_absolute_uri()}|{translation.get_language()}|"
+        f"{request.user.pk}|{request.META.get('CSRF_COOKIE')}|{versions}"
+    )
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+def page_last_modified(request, versions):
+    # В отличие от ETag дата не учитывает пользователя и CSRF, поэтому
+    # своей странице ее не отдаем: проверка идет только по ETag.
+    if request.user.is_authenticated:
+        return None
+    # Версии заводятся по времени в микросекундах, так что самая
+    # свежая из них — не раньше последнего изменения страницы.
+    return datetime.fromtimestamp(max(versions) / 10 ** 6, tz=timezone.utc)
+
+
+def post_page_tags(post, previous_group=None):
+    """Метки страниц, на которых показан пост."""
+    tags = ["feed", f"author:{post.author.username}", f"post:{post.pk}"]
+    if post.group_id is not None:
+        tags.append(f"group:{post.group.slug}")
+    if previous_group:
+        tags.append(f"group:{previous_group}")
+    return tags
+
+
+def bump_page_tags(tags):
+    """Сбрасывает общие страницы с любой из меток ``tags``
+    после коммита транзакции."""
+    keys = [PAGE_TAG_VERSION_KEY.format(tag) for tag in set(tags)]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def personalize(html, user):
+    """Оставляет в общем фрагменте только блоки владельца ``user``.
+
+    Без ``user`` фрагмент остается общим, со всеми метками.
+    """
+    if user is None:
+        return mark_safe(html)
+
+    def replace(match):
+        if str(user.pk) == match.group("owner"):
+            return match.group("body")
+        return ""
+    return mark_safe(OWNER_BLOCK.sub(replace, html))
+
+
+def get_versions(keys):
+    """Версии по ключам кэша, недостающие заводятся заново."""
+    found = cache.get_many(keys)
+    missing = {key: initial_version() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        found.update(missing)
+    return found
+
+
+def post_card_versions(post_ids):
+    """Версии карточек постов, недостающие заводятся заново."""
+    keys = {post_id: POST_CARD_VERSION_KEY.format(post_id)
+            for post_id in post_ids}
+    found = get_versions(list(keys.values()))
+    return {post_id: found[key] for post_id, key in keys.items()}
+
+
+def reset_post_card_versions(post_ids):
+    """Сбрасывает карточки сразу многих постов одним запросом к кэшу."""
+    keys = [POST_CARD_VERSION_KEY.format(post_id) for post_id in post_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def bump_post_card_version(post_id):
+    """Сбрасывает карточку поста после правки, смены картинки
+    или нового комментария, когда транзакция закоммичена."""
+    key = POST_CARD_VERSION_KEY.format(post_id)
+
+    def incr():
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
+    transaction.on_commit(incr)
+
+
+def attach_cards(posts, user=None):
+    """Проставляет постам отрисованные карточки ``post.card``.
+
+    Карточки общие для всех зрителей и достаются из кэша одним
+    get_many; отрисовываются только отсутствующие. Кнопка
+    редактирования в них помечена и без ``user`` остается помеченной.
+    """
+    posts = list(posts)
+    versions = post_card_versions([post.id for post in posts])
+    keys = {post.id: POST_CARD_KEY.format(post.id, versions[post.id])
+            for post in posts}
+    cards = cache.get_many(keys.values())
+    resolve_thumbnails(
+        [post for post in posts if keys[post.id] not in cards]
+    )
+    rendered = {}
+    for post in posts:
+        card = cards.get(keys[post.id])
+        if card is None:
+            card = render_to_string(
+                "posts/post_item.html", {"post": post, "shared": True}
+            )
+            rendered[keys[post.id]] = card
+        if user is None:
+            post.card = mark_safe(card)
+        else:
+            post.card = personalize(card, user)
+    if rendered:
+        cache.set_many(rendered, timeout=None)
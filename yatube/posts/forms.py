@@ -1,5 +1,6 @@
 from django import forms
 
+from .images import describe_upload, ingest
 from .models import Post, Comment
 
 
@@ -13,6 +14,29 @@ class PostForm(forms.ModelForm):
             "image": "Изображение"
         }
 
+    def clean_image(self):
+        image = self.cleaned_data.get("image")
+        if image and "image" in self.changed_data:
+            image = ingest(image)
+        return image
+
+    def save(self, commit=True):
+        post = super().save(commit=False)
+        if "image" in self.changed_data:
+            post.image_width = post.image_height = None
+            post.image_placeholder = ""
+        if "image" in self.changed_data and post.image:
+            # Миниатюры новой картинки готовятся в фоне, а размеры
+            # и превью считаются сразу, чтобы карточка не прыгала.
+            post.thumbnails_ready = False
+            for field, value in describe_upload(
+                self.cleaned_data["image"]
+            ).items():
+                setattr(post, field, value)
+        if commit:
+            post.save()
+        return post
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
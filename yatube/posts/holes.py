@@ -0,0 +1,78 @@
+import re
+
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .forms import CommentForm
+from .models import Follow
+
+HOLE = re.compile(r"<!--hole:(?P<name>\w+)(?P<args>(?::[^:>]*)*)-->")
+
+
+def nav(request):
+    return render_to_string("nav.html", request=request)
+
+
+def menu(request, active):
+    return render_to_string("posts/menu.html", {active: True}, request=request)
+
+
+def follow_button(request, username):
+    following = request.user.is_authenticated and Follow.objects.filter(
+        user=request.user, author__username=username
+    ).exists()
+    context = {
+        "username": username,
+        "display": request.user.username != username,
+        "following": following,
+    }
+    return render_to_string(
+        "posts/follow_button.html", context, request=request
+    )
+
+
+def comment_form(request, username, post_id):
+    if not request.user.is_authenticated:
+        return ""
+    context = {
+        "username": username,
+        "post_id": post_id,
+        "form": CommentForm(request.POST or None),
+    }
+    return render_to_string(
+        "posts/comment_form.html", context, request=request
+    )
+
+
+HOLES = {
+    "nav": nav,
+    "menu": menu,
+    "follow_button": follow_button,
+    "comment_form": comment_form,
+}
+
+
+def is_punching(request):
+    """Рисуется ли сейчас общая для всех страница с дырами."""
+    return getattr(request, "punch_holes", False)
+
+
+def hole(request, name, *args):
+    """Кусок страницы, зависящий от пользователя.
+
+    При общей отрисовке вместо него остается метка, которую
+    ``fill_holes`` заполняет уже для конкретного пользователя.
+    """
+    if is_punching(request):
+        return mark_safe(
+            "<!--hole:" + ":".join([name, *map(str, args)]) + "-->"
+        )
+    return mark_safe(HOLES[name](request, *args))
+
+
+def fill_holes(html, request):
+    """Заполняет метки общей страницы для пользователя ``request``."""
+    def replace(match):
+        args = match.group("args").split(":")[1:]
+        return HOLES[match.group("name")](request, *args)
+    return HOLE.sub(replace, html)
@@ -0,0 +1,170 @@
+import base64
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.template.defaultfilters import filesizeformat
+from PIL import Image, ImageOps
+from sorl.thumbnail import delete as delete_thumbnails
+from sorl.thumbnail.images import ImageFile
+
+from .models import Post, StoredImage
+
+PLACEHOLDER_WIDTH = 16
+
+
+def ingest(upload):
+    """Проверяет загруженную картинку и готовит ее к сохранению.
+
+    Размер файла и число пикселей проверяются по заголовку, до
+    декодирования. Картинка больше POST_IMAGE_MAX_SIDE уменьшается
+    через draft/reduce внутри ``Image.thumbnail``, EXIF удаляется
+    с учетом поворота; из MPO остается первый кадр в JPEG. Анимация не
+    уменьшается, а только пересохраняется без EXIF. Если менять нечего,
+    сохраняется исходный файл.
+    """
+    if upload.size > settings.POST_IMAGE_MAX_BYTES:
+        raise ValidationError(
+            "Файл больше %(limit)s.",
+            code="file_too_large",
+            params={"limit": filesizeformat(settings.POST_IMAGE_MAX_BYTES)},
+        )
+    upload.seek(0)
+    image = Image.open(upload)
+    width, height = image.size
+    if width * height > settings.POST_IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            "Картинка %(width)s×%(height)s слишком большая.",
+            code="too_many_pixels",
+            params={"width": width, "height": height},
+        )
+    limit = settings.POST_IMAGE_MAX_SIDE
+    oversized = max(width, height) > limit
+    if not oversized and "exif" not in image.info:
+        upload.seek(0)
+        return upload
+    image_format = image.format
+    # MPO со снимков телефонов — это JPEG с лишними кадрами, дальше
+    # идет только первый кадр.
+    animated = image_format != "MPO" and getattr(image, "is_animated", False)
+    if image_format == "MPO":
+        image_format = "JPEG"
+    elif animated and oversized:
+        raise ValidationError(
+            "Анимация больше %(limit)s пикселей по стороне.",
+            code="animation_too_large",
+            params={"limit": limit},
+        )
+    options = {"quality": settings.POST_IMAGE_QUALITY}
+    if image.info.get("icc_profile"):
+        options["icc_profile"] = image.info["icc_profile"]
+    if animated:
+        # Кадры анимации по одному не уменьшаем, а пересохраняем все
+        # целиком; длительность и повторы Pillow берет из исходника.
+        options["save_all"] = True
+    else:
+        image.thumbnail((limit, limit))
+        image = ImageOps.exif_transpose(image)
+    if image_format == "JPEG" and image.mode not in ("RGB", "L", "CMYK"):
+        image = image.convert("RGB")
+    output = BytesIO()
+    # EXIF не передается в save и поэтому не попадает в файл.
+    image.save(output, image_format, **options)
+    return SimpleUploadedFile(
+        upload.name, output.getvalue(), Image.MIME.get(image_format)
+    )
+
+
+def describe(image):
+    """Размеры картинки и крошечное превью в data URI.
+
+    Превью обрезано так же, как варианты картинки, и весит около
+    сотни байт, поэтому встраивается прямо в разметку карточки.
+    """
+    from .thumbnails import display_size
+
+    width, height = image.size
+    display_width, display_height = display_size(width, height)
+    size = (
+        PLACEHOLDER_WIDTH,
+        max(round(PLACEHOLDER_WIDTH * display_height / display_width), 1),
+    )
+    image.draft("RGB", size)
+    preview = ImageOps.fit(image.convert("RGB"), size)
+    output = BytesIO()
+    preview.save(output, "WEBP", quality=30)
+    return {
+        "image_width": width,
+        "image_height": height,
+        "image_placeholder": "data:image/webp;base64,"
+        + base64.b64encode(output.getvalue()).decode(),
+    }
+
+
+def describe_upload(upload):
+    upload.seek(0)
+    with Image.open(upload) as image:
+        info = describe(image)
+    upload.seek(0)
+    return info
+
+
+def reserve(name):
+    """Закрепляет имя файла за текущей транзакцией, не меняя ссылок.
+
+    Строка StoredImage блокируется, а если ее нет — создается с нулем
+    ссылок, которую затем учтет ``acquire``. Пока транзакция идет,
+    ``delete_unreferenced`` этот файл не удалит.
+    """
+    if StoredImage.objects.filter(name=name).update(refs=F("refs")):
+        return
+    try:
+        with transaction.atomic():
+            StoredImage.objects.create(name=name, refs=0)
+    except IntegrityError:
+        StoredImage.objects.filter(name=name).update(refs=F("refs"))
+
+
+def acquire(name):
+    """Учитывает еще одну ссылку поста на файл картинки."""
+    if StoredImage.objects.filter(name=name).update(refs=F("refs") + 1):
+        return
+    try:
+        with transaction.atomic():
+            StoredImage.objects.create(name=name, refs=1)
+    except IntegrityError:
+        # Строку параллельно создал другой запрос.
+        StoredImage.objects.filter(name=name).update(refs=F("refs") + 1)
+
+
+def release(name):
+    """Снимает ссылку на файл; последняя ссылка удаляет файл.
+
+    Файл вместе с миниатюрами удаляется после коммита транзакции.
+    """
+    StoredImage.objects.filter(name=name, refs__gt=0).update(
+        refs=F("refs") - 1
+    )
+    deleted, _ = StoredImage.objects.filter(name=name, refs=0).delete()
+    if deleted:
+        transaction.on_commit(lambda: delete_unreferenced(name))
+
+
+def delete_unreferenced(name):
+    storage = Post.image.field.storage
+    if not name.startswith(Post.image.field.upload_to):
+        # Путь вне хранилища постов, такой файл не наш.
+        return
+    try:
+        with transaction.atomic():
+            # Строка держит имя, пока удаляется файл: повторная загрузка
+            # дождется коммита и запишет файл заново.
+            StoredImage.objects.create(name=name, refs=0)
+            delete_thumbnails(ImageFile(name, storage))
+            StoredImage.objects.filter(name=name).delete()
+    except IntegrityError:
+        # Пока шел коммит, файл загрузили снова.
+        return
@@ -0,0 +1,68 @@
+from django.db import transaction
+from sorl.thumbnail.conf import settings
+from sorl.thumbnail.helpers import deserialize, serialize
+from sorl.thumbnail.images import deserialize_image_file, serialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.kvstores.cached_db_kvstore import KVStore as CachedKVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+
+class KVStore(CachedKVStore):
+    """Хранилище ключей sorl-thumbnail с пакетным чтением.
+
+    Сначала ключи читаются из кэша одним get_many, недостающие — одним
+    запросом ``IN`` к таблице; результат, в том числе отсутствие записи,
+    кладется обратно в кэш, чтобы горячие миниатюры не доходили до базы.
+    """
+
+    def get_many(self, image_files):
+        """Словарь ``{ключ ImageFile: сохраненный ImageFile}``."""
+        raw_keys = {add_prefix(image_file.key): image_file.key
+                    for image_file in image_files}
+        values = self.cache.get_many(raw_keys)
+        missing = [key for key in raw_keys if key not in values]
+        if missing:
+            found = dict(
+                KVStoreModel.objects.filter(key__in=missing)
+                .values_list("key", "value")
+            )
+            fetched = {key: found.get(key, EMPTY_VALUE) for key in missing}
+            self.cache.set_many(fetched, settings.THUMBNAIL_CACHE_TIMEOUT)
+            values.update(fetched)
+        return {
+            raw_keys[key]: deserialize_image_file(value)
+            for key, value in values.items()
+            if value and value != EMPTY_VALUE
+        }
+
+    def set_many(self, sources):
+        """Записывает исходники вместе с их миниатюрами пакетом.
+
+        ``sources`` — словарь ``{исходный ImageFile: [ImageFile миниатюр]}``,
+        размеры всех файлов уже должны быть известны. Список миниатюр
+        исходника дополняется, как в ``set``, а не заменяется.
+        """
+        list_keys = {source: add_prefix(source.key, "thumbnails")
+                     for source in sources}
+        stored_lists = dict(
+            KVStoreModel.objects.filter(key__in=list_keys.values())
+            .values_list("key", "value")
+        )
+        values = {}
+        for source, thumbnails in sources.items():
+            values[add_prefix(source.key)] = serialize_image_file(source)
+            keys = set(deserialize(stored_lists.get(list_keys[source], "[]")))
+            for thumbnail in thumbnails:
+                values[add_prefix(thumbnail.key)] = serialize_image_file(
+                    thumbnail
+                )
+                keys.add(thumbnail.key)
+            values[list_keys[source]] = serialize(list(keys))
+        with transaction.atomic():
+            KVStoreModel.objects.filter(key__in=values).delete()
+            KVStoreModel.objects.bulk_create(
+                KVStoreModel(key=key, value=value)
+                for key, value in values.items()
+            )
+        self.cache.set_many(values, settings.THUMBNAIL_CACHE_TIMEOUT)
@@ -0,0 +1,125 @@
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from posts.models import Comment, Follow, Post, TimelineEntry
+from posts.paginators import keyset_queryset
+
+# Полный проход по таблице без индекса и сортировка во временном B-дереве
+FULL_SCAN = re.compile(r"^SCAN (TABLE )?\w+( AS \w+)?$")
+TEMP_SORT = re.compile(r"USE TEMP B-TREE")
+# Проход по индексу с начала: для запроса от позиции курсора это значит,
+# что позиция не ищется по индексу и глубокие страницы дороже первой
+INDEX_WALK = re.compile(
+    r"^SCAN (TABLE )?\w+( AS \w+)? USING (COVERING )?INDEX"
+)
+
+
+def cursor_queries():
+    """Запросы лент от позиции курсора: позицию они должны искать
+    по индексу (SEARCH), а не проходить индекс с начала.
+
+    Значения параметров не важны: план зависит только от формы запроса.
+    """
+    position = (timezone.now(), 1)
+    per_page = settings.POSTS_PER_PAGE + 1
+    posts = Post.objects.for_feed()
+    return {
+        "index, курсор вперед": (
+            keyset_queryset(posts, "pk", position)[:per_page]
+        ),
+        "index, курсор назад": (
+            keyset_queryset(posts, "pk", position, backward=True)[:per_page]
+        ),
+        "group_posts": keyset_queryset(
+            posts.filter(group_id=1), "pk", position
+        )[:per_page],
+        "profile": keyset_queryset(
+            posts.filter(author_id=1), "pk", position
+        )[:per_page],
+        "follow_index, лента": keyset_queryset(
+            TimelineEntry.objects.filter(user_id=1), "post_id", position
+        )[:per_page],
+    }
+
+
+def bounded_queries():
+    """Запросы от курсора, ограниченные по pub_date с обеих сторон.
+
+    Им разрешено сортировать во временном B-дереве: сортируются только
+    строки между курсором и границей.
+    """
+    position = (timezone.now(), 1)
+    per_page = settings.POSTS_PER_PAGE + 1
+    return {
+        "follow_index, популярные авторы": keyset_queryset(
+            Post.objects.for_feed().filter(author_id__in=[1, 2]), "pk",
+            position, until=timezone.now(),
+        )[:per_page],
+    }
+
+
+def feed_queries():
+    """Остальные запросы, которые выполняют представления лент."""
+    per_page = settings.POSTS_PER_PAGE + 1
+    return {
+        "index": keyset_queryset(Post.objects.for_feed(), "pk")[:per_page],
+        "follow_index, список популярных авторов": Follow.objects.filter(
+            user_id=1, author__stats__pulled=True
+        ).values_list("author_id", flat=True),
+        "post_view, комментарии": Comment.objects.filter(
+            post_id=1
+        ).select_related("author"),
+        "profile, подписка": Follow.objects.filter(user_id=1, author_id=2),
+        "new_post, подписчики автора": Follow.objects.filter(
+            author_id=1
+        ).values_list("user_id", flat=True),
+    }
+
+
+def explain(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    help = (
+        "Проверяет планы запросов лент через EXPLAIN QUERY PLAN и падает, "
+        "если какой-то запрос читает всю таблицу или сортирует без индекса"
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("Проверка планов поддерживает только SQLite")
+        failures = []
+        queries = [
+            (name, queryset, False, False)
+            for name, queryset in feed_queries().items()
+        ] + [
+            (name, queryset, True, False)
+            for name, queryset in cursor_queries().items()
+        ] + [
+            (name, queryset, True, True)
+            for name, queryset in bounded_queries().items()
+        ]
+        for name, queryset, seeks, sorts in queries:
+            plan = explain(queryset)
+            bad = [step for step in plan
+                   if FULL_SCAN.match(step)
+                   or not sorts and TEMP_SORT.search(step)
+                   or seeks and INDEX_WALK.match(step)]
+            status = "FAIL" if bad else "OK"
+            self.stdout.write(f"{status} {name}")
+            for step in plan:
+                self.stdout.write(f"    {step}")
+            if bad:
+                failures.append(name)
+        if failures:
+            raise CommandError(
+                "Запросы без подходящего индекса: " + ", ".join(failures)
+            )
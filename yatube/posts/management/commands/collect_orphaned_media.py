@@ -0,0 +1,153 @@
+import os
+import shutil
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.helpers import deserialize
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from posts.models import Post, StoredImage
+
+
+def walk(root):
+    """Файлы под ``root`` по одному, без полного списка в памяти."""
+    if not os.path.isdir(root):
+        return
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет или переносит в карантин картинки постов и миниатюры, "
+        "на которые не ссылаются ни посты, ни KV store sorl"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Сколько файлов сверять с базой за один запрос",
+        )
+        parser.add_argument(
+            "--min-age", type=int, default=60 * 60,
+            help="Не трогать файлы моложе стольких секунд: их пост "
+                 "может быть еще не сохранен",
+        )
+        parser.add_argument(
+            "--quarantine",
+            help="Переносить файлы в этот каталог вместо удаления",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Только посчитать, ничего не меняя",
+        )
+
+    def handle(self, *args, batch_size, min_age, quarantine, dry_run,
+               **options):
+        self.cutoff = time.time() - min_age
+        self.quarantine = quarantine
+        self.dry_run = dry_run
+        self.scanned = self.orphans = self.freed = 0
+        # Миниатюры исходников, признанных мусором в пробном прогоне:
+        # их записи в KV store остаются, но живыми они уже не считаются.
+        self.released = set()
+        started = time.monotonic()
+
+        images = Post.image.field.storage
+        for batch in batches(
+            walk(images.path(Post.image.field.upload_to)), batch_size
+        ):
+            self.collect(images, batch, self.unused_images)
+        thumbnails = default.storage
+        for batch in batches(
+            walk(thumbnails.path(thumbnail_settings.THUMBNAIL_PREFIX)),
+            batch_size,
+        ):
+            self.collect(thumbnails, batch, self.unused_thumbnails)
+
+        elapsed = time.monotonic() - started
+        action = "Найдено" if dry_run else "Убрано"
+        self.stdout.write(
+            f"Просмотрено файлов: {self.scanned}, {action} лишних: "
+            f"{self.orphans} ({self.freed} байт) за {elapsed:.1f} с, "
+            f"{self.scanned / max(elapsed, 1e-6):.0f} файлов/с"
+        )
+
+    def collect(self, storage, entries, unused):
+        self.scanned += len(entries)
+        candidates = {}
+        for entry in entries:
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime <= self.cutoff:
+                name = os.path.relpath(entry.path, storage.location)
+                candidates[name.replace(os.sep, "/")] = (
+                    entry.path, stat.st_size
+                )
+        for name in unused(storage, candidates):
+            path, size = candidates[name]
+            self.orphans += 1
+            self.freed += size
+            if self.dry_run:
+                continue
+            if self.quarantine:
+                target = os.path.join(self.quarantine, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+            else:
+                os.remove(path)
+
+    def unused_images(self, storage, names):
+        used = set(
+            Post.objects.filter(image__in=names)
+            .values_list("image", flat=True)
+        )
+        unused = [name for name in names if name not in used]
+        sources = {}
+        lists = []
+        for name in unused:
+            key = ImageFile(name, storage).key
+            sources[add_prefix(key)] = name
+            lists.append(add_prefix(key, "thumbnails"))
+        thumbnail_keys = [
+            add_prefix(key)
+            for value in KVStoreModel.objects.filter(key__in=lists)
+            .values_list("value", flat=True)
+            for key in deserialize(value)
+        ]
+        if self.dry_run:
+            self.released.update(thumbnail_keys)
+        elif sources:
+            # Записи исходника и его миниатюр убираются из KV store,
+            # файлы миниатюр станут мусором и соберутся следующим проходом.
+            default.kvstore._delete_raw(*sources, *lists, *thumbnail_keys)
+            StoredImage.objects.filter(name__in=sources.values()).delete()
+        return unused
+
+    def unused_thumbnails(self, storage, names):
+        keys = {add_prefix(ImageFile(name, storage).key): name
+                for name in names}
+        used = set(
+            KVStoreModel.objects.filter(key__in=keys)
+            .values_list("key", flat=True)
+        ) - self.released
+        return [name for key, name in keys.items() if key not in used]
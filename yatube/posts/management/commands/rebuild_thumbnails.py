@@ -0,0 +1,107 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from sorl.thumbnail import default
+from sorl.thumbnail.images import deserialize_image_file
+
+from posts import caching
+from posts.models import Post
+from posts.thumbnails import render
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересобирает миниатюры картинок постов в несколько процессов. "
+        "Прерванный запуск продолжается с --start-after"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=100,
+            help="Сколько постов обрабатывать за один пакет",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count(),
+            help="Число процессов, рисующих миниатюры",
+        )
+        parser.add_argument(
+            "--start-after", type=int, default=0,
+            help="Начать с постов, id которых больше заданного",
+        )
+        parser.add_argument(
+            "--force", action="store_true",
+            help="Перерисовать и уже существующие файлы миниатюр",
+        )
+        parser.add_argument(
+            "--pending", action="store_true",
+            help=(
+                "Только посты с неготовыми миниатюрами, например если "
+                "задания потерялись при перезапуске. Запускается "
+                "по расписанию"
+            ),
+        )
+
+    def handle(self, *args, chunk_size, workers, start_after, force,
+               pending, **options):
+        posts = (
+            Post.objects.exclude(image="").exclude(image__isnull=True)
+            .order_by("pk")
+        )
+        if pending:
+            posts = posts.filter(thumbnails_ready=False)
+        total = posts.filter(pk__gt=start_after).count()
+        last_id = start_after
+        done = failed = 0
+        started = time.monotonic()
+        # Процессы-воркеры наследуют открытые соединения при fork.
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=django.setup
+        ) as pool:
+            while True:
+                chunk = list(
+                    posts.filter(pk__gt=last_id)
+                    .values_list("pk", "image")[:chunk_size]
+                )
+                if not chunk:
+                    break
+                # Одинаковые картинки хранятся одним файлом.
+                futures = {pool.submit(render, name, force): name
+                           for name in {name for _, name in chunk}}
+                sources = {}
+                described = {}
+                for future in as_completed(futures):
+                    try:
+                        source, thumbnails, info = future.result()
+                    except Exception as error:
+                        failed += 1
+                        self.stderr.write(f"{futures[future]}: {error}")
+                        continue
+                    sources[deserialize_image_file(source)] = [
+                        deserialize_image_file(thumbnail)
+                        for thumbnail in thumbnails
+                    ]
+                    described[futures[future]] = info
+                default.kvstore.set_many(sources)
+                ids = [pk for pk, _ in chunk]
+                for name, info in described.items():
+                    Post.objects.filter(pk__in=ids, image=name).update(
+                        thumbnails_ready=True, **info
+                    )
+                caching.reset_post_card_versions(pk for pk, _ in chunk)
+                last_id = chunk[-1][0]
+                done += len(chunk)
+                rate = done / (time.monotonic() - started)
+                self.stdout.write(
+                    f"{done}/{total} постов, последний id {last_id}, "
+                    f"{rate:.1f} постов/с"
+                )
+        caching.bump_feed_version()
+        caching.bump_page_tags([caching.ALL_PAGES_TAG])
+        self.stdout.write(
+            f"Готово: {done} постов, ошибок {failed}, последний id {last_id}"
+        )
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from posts import caching
+from posts.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает Post.comment_count по таблице комментариев"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=1000,
+            help="Сколько постов обновлять за одну транзакцию",
+        )
+
+    def handle(self, *args, chunk_size, **options):
+        last_id = 0
+        fixed = 0
+        while True:
+            posts = list(
+                Post.objects.filter(pk__gt=last_id)
+                .select_related("author", "group")
+                .order_by("pk")
+                .only("pk", "comment_count", "author__username",
+                      "group__slug")[:chunk_size]
+            )
+            if not posts:
+                break
+            last_id = posts[-1].pk
+            counts = dict(
+                Comment.objects.filter(post__in=posts)
+                .values_list("post")
+                .annotate(total=Count("pk"))
+                .order_by()
+            )
+            drifted = []
+            for post in posts:
+                actual = counts.get(post.pk, 0)
+                if post.comment_count != actual:
+                    post.comment_count = actual
+                    drifted.append(post)
+            if not drifted:
+                continue
+            with transaction.atomic():
+                Post.objects.bulk_update(drifted, ["comment_count"])
+                # bulk_update не шлет сигналов, поэтому карточки и
+                # страницы с этими постами сбрасываются здесь.
+                caching.reset_post_card_versions(
+                    [post.pk for post in drifted]
+                )
+                caching.bump_page_tags([
+                    tag for post in drifted
+                    for tag in caching.post_page_tags(post)
+                ])
+                caching.bump_feed_version()
+            fixed += len(drifted)
+        self.stdout.write(f"Исправлено постов: {fixed}")
@@ -0,0 +1,57 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import caching
+from posts.models import UserStats
+from posts.stats import count, is_pulled
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Сверяет счетчики UserStats с исходными таблицами"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=500,
+            help="Сколько пользователей сверять за одну транзакцию",
+        )
+
+    def handle(self, *args, chunk_size, **options):
+        last_id = 0
+        fixed = 0
+        while True:
+            users = dict(
+                User.objects.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", "username")[:chunk_size]
+            )
+            if not users:
+                break
+            last_id = max(users)
+            existing = UserStats.objects.in_bulk(list(users))
+            repaired = []
+            with transaction.atomic():
+                for user_id, username in users.items():
+                    actual = count(user_id)
+                    stats = existing.get(user_id)
+                    if stats is None:
+                        UserStats.objects.create(
+                            user_id=user_id, pulled=is_pulled(actual),
+                            **actual
+                        )
+                        repaired.append(username)
+                        continue
+                    if any(getattr(stats, field) != value
+                           for field, value in actual.items()):
+                        UserStats.objects.filter(user_id=user_id).update(
+                            **actual
+                        )
+                        repaired.append(username)
+                        fixed += 1
+                # Счетчики показаны на страницах пользователя.
+                caching.bump_page_tags(
+                    [f"stats:{username}" for username in repaired]
+                )
+        self.stdout.write(f"Исправлено счетчиков: {fixed}")
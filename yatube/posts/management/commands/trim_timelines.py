@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from posts.models import TimelineEntry
+from posts.timeline import trim
+
+
+class Command(BaseCommand):
+    help = (
+        "Обрезает материализованные ленты подписок до "
+        "TIMELINE_MAX_ENTRIES записей. Запускается по расписанию"
+    )
+
+    def handle(self, *args, **options):
+        user_ids = list(
+            TimelineEntry.objects.values("user_id")
+            .annotate(total=Count("pk"))
+            .filter(total__gt=settings.TIMELINE_MAX_ENTRIES)
+            .order_by()
+            .values_list("user_id", flat=True)
+        )
+        for user_id in user_ids:
+            trim(user_id)
+        self.stdout.write(f"Обрезано лент: {len(user_ids)}")
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.6 on 2026-10-17 05:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_post_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='thumbnails_ready',
+            field=models.BooleanField(default=True, editable=False, verbose_name='Миниатюры готовы'),
+        ),
+    ]
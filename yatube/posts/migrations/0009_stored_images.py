@@ -0,0 +1,40 @@
+# Generated by Django 2.2.6 on 2026-10-17 06:07
+
+from django.db import migrations, models
+from django.db.models import Count
+import posts.storage
+
+
+def count_references(apps, schema_editor):
+    Post = apps.get_model("posts", "Post")
+    StoredImage = apps.get_model("posts", "StoredImage")
+    rows = (
+        Post.objects.exclude(image="").exclude(image__isnull=True)
+        .values("image").annotate(refs=Count("id")).order_by()
+    )
+    StoredImage.objects.bulk_create(
+        StoredImage(name=row["image"], refs=row["refs"]) for row in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_post_thumbnails_ready'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('refs', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=posts.storage.ContentAddressedStorage(), upload_to='posts/'),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
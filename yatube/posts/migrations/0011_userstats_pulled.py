@@ -0,0 +1,27 @@
+# Generated by Django 2.2.6 on 2026-10-17 06:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_pulled(apps, schema_editor):
+    UserStats = apps.get_model("posts", "UserStats")
+    UserStats.objects.filter(
+        followers_count__gt=settings.FANOUT_FOLLOWER_THRESHOLD
+    ).update(pulled=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_post_image_dimensions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='pulled',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_pulled, migrations.RunPython.noop),
+    ]
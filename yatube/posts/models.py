@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from .storage import ContentAddressedStorage
+
 User = get_user_model()
 
 
@@ -13,6 +15,12 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Посты для лент: автор и группа выбираются одним запросом."""
+        return self.select_related("author", "group")
+
+
 class Post(models.Model):
     text = models.TextField(null=False, verbose_name="Текст записи")
     pub_date = models.DateTimeField("date published", auto_now_add=True)
@@ -27,10 +35,40 @@ class Post(models.Model):
         related_name="posts",
         verbose_name="Группа",
     )
-    image = models.ImageField(upload_to="posts/", blank=True, null=True)
+    image = models.ImageField(
+        upload_to="posts/",
+        storage=ContentAddressedStorage(),
+        blank=True,
+        null=True,
+    )
+    image_width = models.PositiveIntegerField(
+        null=True, editable=False, verbose_name="Ширина картинки"
+    )
+    image_height = models.PositiveIntegerField(
+        null=True, editable=False, verbose_name="Высота картинки"
+    )
+    image_placeholder = models.TextField(
+        blank=True, editable=False, verbose_name="Превью картинки"
+    )
+    thumbnails_ready = models.BooleanField(
+        default=True, editable=False, verbose_name="Миниатюры готовы"
+    )
+    comment_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Количество комментариев"
+    )
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ["-pub_date"]
+        indexes = [
+            models.Index(fields=["-pub_date", "-id"],
+                         name="post_pub_date_idx"),
+            models.Index(fields=["author", "-pub_date", "-id"],
+                         name="post_author_pub_date_idx"),
+            models.Index(fields=["group", "-pub_date", "-id"],
+                         name="post_group_pub_date_idx"),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -55,6 +93,10 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ["-created"]
+        indexes = [
+            models.Index(fields=["post", "-created"],
+                         name="comment_post_created_idx"),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -77,3 +119,60 @@ class Follow(models.Model):
             models.UniqueConstraint(fields=["user", "author"],
                                     name="unique_follow")
         ]
+        indexes = [
+            models.Index(fields=["author", "user"],
+                         name="follow_author_user_idx"),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """Запись материализованной ленты подписок пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        related_name="timeline",
+        on_delete=models.CASCADE
+    )
+    post = models.ForeignKey(
+        Post,
+        related_name="timeline_entries",
+        on_delete=models.CASCADE
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        ordering = ["-pub_date"]
+        constraints = [
+            models.UniqueConstraint(fields=["user", "post"],
+                                    name="unique_timeline_entry")
+        ]
+        indexes = [
+            models.Index(fields=["user", "-pub_date", "-post"],
+                         name="timeline_user_pub_post_idx")
+        ]
+
+
+class UserStats(models.Model):
+    """Счетчики пользователя для профиля и страницы поста."""
+
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        related_name="stats",
+        on_delete=models.CASCADE
+    )
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # Посты автора читаются при показе ленты, а не раскладываются по
+    # лентам. Флаг ставится, когда подписчиков становится больше
+    # FANOUT_FOLLOWER_THRESHOLD, и не снимается: прежние посты автора
+    # в ленты подписчиков не попадали.
+    pulled = models.BooleanField(default=False)
+
+
+class StoredImage(models.Model):
+    """Файл картинки и число постов, которые на него ссылаются."""
+
+    name = models.CharField(max_length=100, primary_key=True)
+    refs = models.PositiveIntegerField(default=0)
@@ -0,0 +1,328 @@
+import base64
+import binascii
+import hashlib
+import heapq
+import json
+from itertools import islice
+from math import ceil
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import Post
+
+FORWARD = "next"
+BACKWARD = "prev"
+
+
+def encode_cursor(pub_date, key, number, direction):
+    """Упаковывает позицию (pub_date, id) в непрозрачный токен для URL."""
+    payload = json.dumps(
+        [direction, number, pub_date.isoformat(), key]
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Разбирает токен курсора, для испорченного токена возвращает None."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        direction, number, pub_date, pk = json.loads(
+            base64.urlsafe_b64decode(padded.encode()).decode()
+        )
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        return None
+    pub_date = parse_datetime(str(pub_date))
+    if (
+        direction not in (FORWARD, BACKWARD)
+        or pub_date is None
+        or not isinstance(number, int)
+        or not isinstance(pk, int)
+        or number < 1
+    ):
+        return None
+    return direction, number, pub_date, pk
+
+
+def keyset(queryset, key_field, position=None, backward=False, limit=None,
+           offset=0, until=None):
+    """Выбирает строки queryset, следующие за позицией курсора.
+
+    Строки упорядочены по (pub_date, key_field) по убыванию, а при
+    ``backward`` — по возрастанию, начиная от позиции к началу ленты.
+    """
+    return list(
+        keyset_queryset(queryset, key_field, position, backward, until)
+        [offset:offset + limit]
+    )
+
+
+def keyset_queryset(queryset, key_field, position=None, backward=False,
+                    until=None):
+    """Queryset выборки от позиции курсора, без ограничения по числу.
+
+    ``until`` — pub_date, дальше которого выборка не идет.
+    """
+    queryset = queryset.order_by("-pub_date", f"-{key_field}")
+    if position is not None:
+        pub_date, key = position
+        lookup = "gt" if backward else "lt"
+        # Диапазон по pub_date нужен, чтобы SQLite искал позицию
+        # по индексу, а не проходил его от начала: одного OR мало.
+        queryset = queryset.filter(
+            **{f"pub_date__{lookup}e": pub_date}
+        ).filter(
+            Q(**{f"pub_date__{lookup}": pub_date})
+            | Q(pub_date=pub_date, **{f"{key_field}__{lookup}": key})
+        )
+    if until is not None:
+        queryset = queryset.filter(
+            **{"pub_date__lte" if backward else "pub_date__gte": until}
+        )
+    if backward:
+        queryset = queryset.reverse()
+    return queryset
+
+
+def table_estimate(model):
+    """Число строк таблицы по статистике ANALYZE, если она собрана."""
+    if connection.vendor != "sqlite":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+        )
+        if cursor.fetchone() is None:
+            return None
+        cursor.execute(
+            "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1",
+            [model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    return int(row[0].split()[0]) if row else None
+
+
+def approximate_count(queryset):
+    """Приблизительное число строк queryset.
+
+    Для всей таблицы берется оценка из sqlite_stat1, для выборок с
+    фильтром — COUNT(*), который кэшируется на PAGINATOR_COUNT_TIMEOUT,
+    так что точный подсчет делается не чаще раза за этот период.
+    """
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.md5(f"{sql}{params}".encode()).hexdigest()
+    cache_key = f"approximate-count-{digest}"
+    count = cache.get(cache_key)
+    if count is None:
+        if not queryset.query.where:
+            count = table_estimate(queryset.model)
+        if count is None:
+            count = queryset.count()
+        cache.set(cache_key, count, settings.PAGINATOR_COUNT_TIMEOUT)
+    return count
+
+
+def page_window(number, num_pages, on_each_side):
+    """Номера страниц вокруг текущей плюс первая и последняя.
+
+    Пропуски между ними обозначаются None.
+    """
+    pages = {1, num_pages} | set(
+        range(max(number - on_each_side, 1),
+              min(number + on_each_side, num_pages) + 1)
+    )
+    window = []
+    previous = 0
+    for page_number in sorted(pages):
+        if page_number - previous > 1:
+            window.append(None)
+        window.append(page_number)
+        previous = page_number
+    return window
+
+
+class CursorPaginator(Paginator):
+    """Keyset-пагинация ленты по (pub_date, id).
+
+    Страница ищется по индексу от позиции курсора, а не через OFFSET,
+    поэтому глубокие страницы стоят столько же, сколько первая.
+    Общее число записей не считается: наличие следующей страницы
+    определяется по одной лишней строке в выборке.
+    """
+
+    key_field = "pk"
+
+    def __init__(self, object_list, per_page, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._number = 1
+        self._num_pages = 1
+
+    @property
+    def num_pages(self):
+        return self._num_pages
+
+    @property
+    def estimated_num_pages(self):
+        """Оценка числа страниц для навигации без точного COUNT(*)."""
+        if self._num_pages == self._number:
+            # Следующей страницы нет, значит текущая — последняя.
+            return self._number
+        estimate = ceil(self.approximate_count() / self.per_page)
+        return max(estimate, self._num_pages)
+
+    def approximate_count(self):
+        return approximate_count(self.object_list)
+
+    def get_page(self, cursor=None, number=None):
+        """Возвращает страницу по токену курсора.
+
+        Без курсора поддерживаются старые ссылки вида ``?page=N``:
+        такая страница выбирается через OFFSET, но без COUNT(*).
+        """
+        position = decode_cursor(cursor) if cursor else None
+        if position is None:
+            return self._offset_page(number)
+        direction, number, pub_date, key = position
+        if direction == FORWARD:
+            return self._page_after((pub_date, key), number)
+        return self._page_before((pub_date, key), number)
+
+    def restore_page(self, object_list, number, next_cursor,
+                     previous_cursor):
+        """Собирает страницу по сохраненным в кэше курсорам."""
+        self._number = number
+        self._num_pages = number + 1 if next_cursor else number
+        page = self._get_page(object_list, number, self)
+        page.next_cursor = next_cursor
+        page.previous_cursor = previous_cursor
+        return page
+
+    def fetch(self, position=None, backward=False, limit=None, offset=0,
+              until=None):
+        """Возвращает строки ленты от позиции курсора."""
+        return keyset(
+            self.object_list, self.key_field, position, backward, limit,
+            offset, until
+        )
+
+    def get_objects(self, rows):
+        """Превращает строки выборки в объекты страницы."""
+        return rows
+
+    def row_key(self, row):
+        return row.pub_date, getattr(row, self.key_field)
+
+    def _offset_page(self, number):
+        try:
+            number = max(int(number), 1)
+        except (TypeError, ValueError):
+            number = 1
+        rows = self.fetch(
+            limit=self.per_page + 1, offset=(number - 1) * self.per_page
+        )
+        if not rows and number > 1:
+            # Номер за концом ленты: как Paginator.get_page, отдаем
+            # последнюю страницу, а если оценка промахнулась — первую.
+            number = min(
+                number - 1,
+                max(ceil(self.approximate_count() / self.per_page), 1),
+            )
+            rows = self.fetch(
+                limit=self.per_page + 1,
+                offset=(number - 1) * self.per_page,
+            )
+            if not rows:
+                return self._offset_page(1)
+        has_next = len(rows) > self.per_page
+        return self._build_page(rows, number, has_next=has_next)
+
+    def _page_after(self, position, number):
+        rows = self.fetch(position, limit=self.per_page + 1)
+        has_next = len(rows) > self.per_page
+        return self._build_page(rows, number, has_next=has_next)
+
+    def _page_before(self, position, number):
+        rows = self.fetch(position, backward=True, limit=self.per_page + 1)
+        if len(rows) <= self.per_page:
+            # Дошли до начала ленты — это первая страница.
+            number = 1
+        rows = rows[:self.per_page][::-1]
+        return self._build_page(rows, max(number, 1), has_next=True)
+
+    def _build_page(self, rows, number, has_next):
+        rows = rows[:self.per_page]
+        self._number = number
+        self._num_pages = number + 1 if has_next and rows else number
+        page = self._get_page(self.get_objects(rows), number, self)
+        page.next_cursor = None
+        page.previous_cursor = None
+        if rows and has_next:
+            page.next_cursor = encode_cursor(
+                *self.row_key(rows[-1]), number + 1, FORWARD
+            )
+        if rows and number > 1:
+            page.previous_cursor = encode_cursor(
+                *self.row_key(rows[0]), number - 1, BACKWARD
+            )
+        return page
+
+
+class TimelinePaginator(CursorPaginator):
+    """Постраничный вывод материализованной ленты подписок.
+
+    Курсор строится по (pub_date, post_id) записей ленты, а на страницу
+    попадают их посты.
+    """
+
+    key_field = "post_id"
+
+    def get_objects(self, rows):
+        posts = Post.objects.for_feed().in_bulk(
+            [entry.post_id for entry in rows]
+        )
+        return [posts[entry.post_id] for entry in rows
+                if entry.post_id in posts]
+
+
+class MergedPaginator(CursorPaginator):
+    """Лента, собранная k-way слиянием нескольких отсортированных потоков.
+
+    Каждый поток — CursorPaginator, отдающий посты по одному и тому же
+    курсору (pub_date, id поста); из каждого читается не больше одной
+    страницы. Если первый поток отдал страницу целиком, остальные
+    читаются только до ее последней даты: дальше слияние не дойдет.
+    """
+
+    def __init__(self, streams, per_page, **kwargs):
+        super().__init__([], per_page, **kwargs)
+        self.streams = streams
+
+    def approximate_count(self):
+        return sum(stream.approximate_count() for stream in self.streams)
+
+    def fetch(self, position=None, backward=False, limit=None, offset=0,
+              until=None):
+        sources = []
+        for stream in self.streams:
+            rows = stream.fetch(position, backward, limit + offset,
+                                until=until)
+            sources.append(stream.get_objects(rows))
+            if until is None and len(rows) == limit + offset:
+                until = stream.row_key(rows[-1])[0]
+        merged = heapq.merge(
+            *sources, key=self.row_key, reverse=not backward
+        )
+        return list(islice(self._unique(merged), offset, offset + limit))
+
+    def _unique(self, posts):
+        # Пост может прийти и из ленты, и из потока автора, если
+        # автор пересек порог подписчиков; такие дубли идут подряд.
+        last_key = None
+        for post in posts:
+            if post.pk != last_key:
+                yield post
+            last_key = post.pk
@@ -0,0 +1,86 @@
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+
+MATCH_SQL = "SELECT rowid FROM posts_post_fts WHERE posts_post_fts MATCH %s"
+
+
+def match_expression(query):
+    """Превращает пользовательский запрос в безопасный запрос FTS5.
+
+    Каждое слово ищется как префикс, все слова должны встретиться.
+    """
+    terms = re.findall(r"\w+", query)
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def index_post(post):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM posts_post_fts WHERE rowid = %s", [post.pk]
+        )
+        cursor.execute(
+            "INSERT INTO posts_post_fts(rowid, text) VALUES (%s, %s)",
+            [post.pk, post.text],
+        )
+
+
+def unindex_post(post_id):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM posts_post_fts WHERE rowid = %s", [post_id]
+        )
+
+
+def filter_matching(queryset, query):
+    """Оставляет в queryset посты, найденные полнотекстовым индексом."""
+    match = match_expression(query)
+    if not match:
+        return queryset.none()
+    return queryset.filter(pk__in=RawSQL(MATCH_SQL, [match]))
+
+
+class SearchResults:
+    """Результаты поиска, упорядоченные по BM25, для Paginator.
+
+    Срез читает из индекса только id нужной страницы, посты затем
+    выбираются одним запросом.
+    """
+
+    def __init__(self, query):
+        self.match = match_expression(query)
+
+    def count(self):
+        if not self.match:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM posts_post_fts "
+                "WHERE posts_post_fts MATCH %s",
+                [self.match],
+            )
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            raise TypeError("Результаты поиска поддерживают только срезы")
+        start = item.start or 0
+        if not self.match or item.stop <= start:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT rowid FROM posts_post_fts "
+                "WHERE posts_post_fts MATCH %s "
+                "ORDER BY bm25(posts_post_fts), rowid DESC "
+                "LIMIT %s OFFSET %s",
+                [self.match, item.stop - start, start],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        posts = Post.objects.for_feed().in_bulk(ids)
+        return [posts[post_id] for post_id in ids if post_id in posts]
@@ -0,0 +1,155 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import caching, images, search, stats, timeline
+from .models import Comment, Follow, Post
+
+
+@receiver(post_save, sender=Post)
+def post_counted(sender, instance, created, **kwargs):
+    if created:
+        stats.change(instance.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def post_uncounted(sender, instance, **kwargs):
+    stats.change(instance.author_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_counted(sender, instance, created, **kwargs):
+    if created:
+        stats.change(instance.author_id, followers_count=1)
+        stats.change(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_uncounted(sender, instance, **kwargs):
+    stats.change(instance.author_id, followers_count=-1)
+    stats.change(instance.user_id, following_count=-1)
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    if created:
+        timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        timeline.mark_pulled(instance.author_id)
+        timeline.backfill(instance.user, instance.author)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    timeline.prune(instance.user, instance.author)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def feed_changed(sender, **kwargs):
+    caching.bump_feed_version()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_pages_changed(sender, instance, created=False, **kwargs):
+    tags = caching.post_page_tags(
+        instance, getattr(instance, "_previous_group", None)
+    )
+    if created or kwargs["signal"] is post_delete:
+        tags.append(f"stats:{instance.author.username}")
+    caching.bump_page_tags(tags)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_pages_changed(sender, instance, **kwargs):
+    post = (
+        Post.objects.select_related("author", "group")
+        .filter(pk=instance.post_id).first()
+    )
+    if post is not None:
+        caching.bump_page_tags(caching.post_page_tags(post))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_pages_changed(sender, instance, **kwargs):
+    caching.bump_page_tags([
+        f"stats:{instance.author.username}",
+        f"stats:{instance.user.username}",
+    ])
+
+
+@receiver(post_save, sender=Post)
+def post_card_changed(sender, instance, **kwargs):
+    caching.bump_post_card_version(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def post_comments_changed(sender, instance, **kwargs):
+    caching.bump_post_card_version(instance.post_id)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created and instance.post_id is not None:
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=F("comment_count") + 1
+        )
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance.post_id is not None:
+        Post.objects.filter(pk=instance.post_id, comment_count__gt=0).update(
+            comment_count=F("comment_count") - 1
+        )
+
+
+@receiver(post_save, sender=Post)
+def post_indexed(sender, instance, **kwargs):
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_unindexed(sender, instance, **kwargs):
+    search.unindex_post(instance.pk)
+
+
+@receiver(pre_save, sender=Post)
+def post_previous_remembered(sender, instance, **kwargs):
+    # Прежнее имя файла нужно, чтобы снять с него ссылку после замены,
+    # а прежняя группа — чтобы сбросить ее страницу.
+    instance._previous_image = ""
+    instance._previous_group = None
+    if instance.pk is not None and not instance._state.adding:
+        instance._previous_image, instance._previous_group = (
+            Post.objects.filter(pk=instance.pk)
+            .values_list("image", "group__slug").first() or ("", None)
+        )
+
+
+@receiver(post_save, sender=Post)
+def post_image_referenced(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_image", "")
+    current = instance.image.name or ""
+    if current == previous:
+        return
+    if current:
+        images.acquire(current)
+    if previous:
+        images.release(previous)
+
+
+@receiver(post_delete, sender=Post)
+def post_image_released(sender, instance, **kwargs):
+    if instance.image:
+        images.release(instance.image.name)
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Follow, Post, UserStats
+
+
+def count(user_id):
+    """Считает счетчики пользователя по исходным таблицам."""
+    return {
+        "posts_count": Post.objects.filter(author_id=user_id).count(),
+        "followers_count": Follow.objects.filter(author_id=user_id).count(),
+        "following_count": Follow.objects.filter(user_id=user_id).count(),
+    }
+
+
+def is_pulled(counts):
+    """Читать ли посты автора при показе ленты, а не рассылать их."""
+    return counts["followers_count"] > settings.FANOUT_FOLLOWER_THRESHOLD
+
+
+def get_stats(user_id):
+    """Строка счетчиков пользователя; при первом обращении создается."""
+    stats = UserStats.objects.filter(user_id=user_id).first()
+    if stats is not None:
+        return stats
+    counts = count(user_id)
+    try:
+        with transaction.atomic():
+            return UserStats.objects.create(
+                user_id=user_id, pulled=is_pulled(counts), **counts
+            )
+    except IntegrityError:
+        return UserStats.objects.get(user_id=user_id)
+
+
+def change(user_id, **deltas):
+    """Атомарно сдвигает счетчики пользователя.
+
+    Отсутствующая строка не создается: она будет посчитана целиком
+    при первом чтении.
+    """
+    UserStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
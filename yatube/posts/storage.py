@@ -0,0 +1,47 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла — хэш его содержимого.
+
+    Файл ``posts/photo.jpg`` сохраняется как ``posts/ab/cd/<sha256>.jpg``
+    с такими же каталогами, как у миниатюр sorl. Повторная загрузка тех
+    же байтов не создает новый файл, а возвращает имя существующего.
+    """
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(
+            directory, digest[:2], digest[2:4], digest + extension
+        )
+
+    def save(self, name, content, max_length=None):
+        from .images import reserve
+
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        # Имя закрепляется до проверки файла, иначе его может удалить
+        # транзакция, снявшая с файла последнюю ссылку.
+        reserve(name)
+        if self.exists(name):
+            return name
+        saved = self._save(name, content)
+        if saved != name:
+            # Тот же файл параллельно записал другой запрос.
+            self.delete(saved)
+        return name
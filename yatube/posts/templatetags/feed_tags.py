@@ -0,0 +1,89 @@
+import logging
+
+from django import template
+from django.conf import settings
+from sorl.thumbnail import get_thumbnail
+from sorl.thumbnail.conf import settings as thumbnail_settings
+
+from .. import holes
+from ..paginators import page_window
+from ..thumbnails import MIME_TYPES, display_size, variants
+
+logger = logging.getLogger(__name__)
+
+register = template.Library()
+
+
+@register.filter
+def window(page):
+    """Окно номеров страниц для навигации по ``page``."""
+    paginator = page.paginator
+    num_pages = getattr(
+        paginator, "estimated_num_pages", paginator.num_pages
+    )
+    return page_window(page.number, num_pages, settings.PAGINATOR_WINDOW)
+
+
+@register.simple_tag(takes_context=True)
+def hole(context, name, *args):
+    """Кусок страницы, который дорисовывается для каждого пользователя."""
+    return holes.hole(context["request"], name, *args)
+
+
+def srcset(thumbnails):
+    return ", ".join(
+        f"{thumbnail.url} {thumbnail.width}w" for thumbnail in thumbnails
+    )
+
+
+@register.inclusion_tag("posts/post_image.html")
+def post_image(post):
+    """Картинка поста с вариантами разной ширины и формата.
+
+    Варианты берутся из ``post.variants``, проставленных
+    ``thumbnails.resolve``; последний формат POST_IMAGE_FORMATS идет
+    в ``<img>``, остальные — в ``<source>`` элемента ``<picture>``.
+    Пока картинка грузится, под ней видно превью, сохраненное на посте.
+    """
+    if not post.image:
+        return {}
+    width, height = display_size(post.image_width, post.image_height)
+    context = {
+        "sizes": settings.POST_IMAGE_SIZES,
+        "placeholder": post.image_placeholder,
+        "placeholder_padding": f"{height / width:.2%}",
+    }
+    found = getattr(post, "variants", None)
+    if found is None:
+        if not post.thumbnails_ready:
+            return context
+        # Пост пришел без пакетного resolve: готовим только
+        # крупнейший вариант запасного формата, как тег thumbnail.
+        fallback = settings.POST_IMAGE_FORMATS[-1]
+        geometry, options = variants()[fallback][-1]
+        try:
+            thumbnail = get_thumbnail(post.image, geometry, **options)
+        except Exception:
+            if thumbnail_settings.THUMBNAIL_DEBUG:
+                raise
+            logger.exception("Не удалось подготовить миниатюру поста")
+            return {}
+        if not thumbnail.size:
+            # Исходного файла нет, sorl вернул пустую миниатюру.
+            return {}
+        found = {fallback: [thumbnail]}
+    *sources, fallback = [
+        (image_format, found[image_format])
+        for image_format in settings.POST_IMAGE_FORMATS
+        if found.get(image_format)
+    ]
+    image_format, thumbnails = fallback
+    context.update({
+        "image": thumbnails[-1],
+        "srcset": srcset(thumbnails),
+        "sources": [
+            {"type": MIME_TYPES[image_format], "srcset": srcset(thumbnails)}
+            for image_format, thumbnails in sources
+        ],
+    })
+    return context
@@ -0,0 +1,138 @@
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from posts.caching import get_or_compute
+from yatube.cache import FileBasedCache, TieredCache
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "tiered-test-shared",
+    },
+}
+
+
+def worker(name):
+    """Отдельный L1 над общим L2, как у другого процесса."""
+    return TieredCache(name, {
+        "OPTIONS": {"L2": "shared", "SYNC_INTERVAL": 0},
+    })
+
+
+@override_settings(CACHES=CACHES)
+class TieredCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.first = worker("tiered-test-first")
+        self.second = worker("tiered-test-second")
+        self.first.clear()
+        self.second.clear()
+        self.first.counters.clear()
+        self.second.counters.clear()
+
+    def test_values_are_shared_through_l2(self):
+        """Запись одного процесса читается другим через L2, затем из L1"""
+        self.first.set("key", "value")
+
+        self.assertEqual(self.second.get("key"), "value")
+        self.assertEqual(self.second.get("key"), "value")
+        self.assertEqual(self.second.get("missing"), None)
+
+        self.assertEqual(self.second.stats(), {
+            "l1": {"hits": 1, "misses": 2},
+            "l2": {"hits": 1, "misses": 1},
+        })
+
+    def test_incr_reaches_other_l1(self):
+        """Смена версии в одном процессе сбрасывает L1 остальных"""
+        self.first.set("version", 1)
+        self.assertEqual(self.second.get("version"), 1)
+
+        self.first.incr("version")
+
+        self.assertEqual(self.second.get("version"), 2)
+
+    def test_delete_reaches_other_l1(self):
+        self.first.set("key", "value")
+        self.assertEqual(self.second.get_many(["key"]), {"key": "value"})
+
+        self.first.delete("key")
+
+        self.assertEqual(self.second.get_many(["key"]), {})
+
+
+class FileBasedCacheTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.cache = FileBasedCache(directory, {})
+
+    def test_add_keeps_existing_value(self):
+        """Второй add того же ключа не перезаписывает значение"""
+        self.assertTrue(self.cache.add("lease", "first"))
+        self.assertFalse(self.cache.add("lease", "second"))
+        self.assertEqual(self.cache.get("lease"), "first")
+
+    def test_add_replaces_expired_value(self):
+        self.cache.set("lease", "first", timeout=-1)
+
+        self.assertTrue(self.cache.add("lease", "second"))
+        self.assertEqual(self.cache.get("lease"), "second")
+
+    def test_concurrent_incr_loses_no_updates(self):
+        """Одновременные incr не теряют увеличений"""
+        self.cache.set("version", 0, timeout=None)
+
+        def bump(_):
+            for _ in range(25):
+                self.cache.incr("version")
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(bump, range(4)))
+
+        self.assertEqual(self.cache.get("version"), 100)
+
+
+@override_settings(CACHE_LEASE_WAIT=0)
+class GetOrComputeTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_fresh_value_is_not_recomputed(self):
+        """Свежее значение той же версии берется из кэша"""
+        self.assertEqual(get_or_compute("key", self.compute, 60, 1), 1)
+        self.assertEqual(get_or_compute("key", self.compute, 60, 1), 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_is_served_while_leased(self):
+        """Пока другой запрос держит аренду, отдается прежнее значение"""
+        get_or_compute("key", self.compute, 60, 1)
+        cache.add("key:lease", "other", 30)
+
+        self.assertEqual(get_or_compute("key", self.compute, 60, 2), 1)
+        self.assertEqual(self.calls, 1)
+
+        cache.delete("key:lease")
+        self.assertEqual(get_or_compute("key", self.compute, 60, 2), 2)
+        self.assertIsNone(cache.get("key:lease"))
+
+    def test_expensive_value_is_recomputed_early(self):
+        """Дорогое значение пересчитывается до истечения срока"""
+        get_or_compute("key", self.compute, 60, 1)
+        entry = cache.get("key")
+        entry["delta"] = 1000
+        cache.set("key", entry)
+
+        with mock.patch("posts.caching.random.random", return_value=0.99):
+            self.assertEqual(get_or_compute("key", self.compute, 60, 1), 2)
@@ -0,0 +1,292 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from sorl.thumbnail import default
+
+from ..models import Comment, Follow, Post, UserStats
+from ..stats import get_stats
+from ..thumbnails import generate, resolve
+
+User = get_user_model()
+
+
+class RecountCommentsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.leo = User.objects.create_user(username="leo")
+        cls.post = Post.objects.create(text="Пост", author=cls.leo)
+
+    def test_comment_count_follows_comments(self):
+        """Счетчик комментариев меняется при создании и удалении"""
+        comment = Comment.objects.create(
+            post=self.post, author=self.leo, text="Комментарий"
+        )
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+        comment.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 0)
+
+    def test_recount_comments_fixes_drift(self):
+        """Команда recount_comments исправляет разошедшийся счетчик"""
+        Comment.objects.create(
+            post=self.post, author=self.leo, text="Комментарий"
+        )
+        Post.objects.filter(pk=self.post.pk).update(comment_count=7)
+
+        call_command("recount_comments", chunk_size=1, stdout=StringIO())
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+    def test_recount_comments_resets_cached_pages(self):
+        """После пересчета сбрасываются карточки и страницы постов"""
+        Post.objects.filter(pk=self.post.pk).update(comment_count=7)
+
+        with mock.patch("posts.caching.reset_post_card_versions") as reset, \
+                mock.patch("posts.caching.bump_page_tags") as bump:
+            call_command("recount_comments", stdout=StringIO())
+
+        reset.assert_called_once_with([self.post.pk])
+        tags = bump.call_args[0][0]
+        self.assertIn("author:leo", tags)
+        self.assertIn(f"post:{self.post.pk}", tags)
+
+
+class UserStatsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.leo = User.objects.create_user(username="leo")
+        cls.reader = User.objects.create_user(username="reader")
+
+    def test_stats_follow_posts_and_follows(self):
+        """Счетчики пользователя меняются вместе с постами и подписками"""
+        get_stats(self.leo.pk)
+        get_stats(self.reader.pk)
+
+        post = Post.objects.create(text="Пост", author=self.leo)
+        follow = Follow.objects.create(user=self.reader, author=self.leo)
+        leo_stats = get_stats(self.leo.pk)
+        self.assertEqual(leo_stats.posts_count, 1)
+        self.assertEqual(leo_stats.followers_count, 1)
+        self.assertEqual(get_stats(self.reader.pk).following_count, 1)
+
+        post.delete()
+        follow.delete()
+        leo_stats = get_stats(self.leo.pk)
+        self.assertEqual(leo_stats.posts_count, 0)
+        self.assertEqual(leo_stats.followers_count, 0)
+
+    def test_repair_user_stats_fixes_drift(self):
+        """Команда repair_user_stats исправляет разошедшиеся счетчики"""
+        Post.objects.create(text="Пост", author=self.leo)
+        get_stats(self.leo.pk)
+        UserStats.objects.filter(user=self.leo).update(posts_count=5)
+
+        call_command("repair_user_stats", chunk_size=1, stdout=StringIO())
+
+        self.assertEqual(get_stats(self.leo.pk).posts_count, 1)
+
+    @override_settings(FANOUT_FOLLOWER_THRESHOLD=0)
+    def test_repair_user_stats_creates_pulled_rows(self):
+        """Недостающая строка создается с признаком pulled, а страницы
+        пользователя сбрасываются"""
+        Follow.objects.create(user=self.reader, author=self.leo)
+        UserStats.objects.all().delete()
+
+        with mock.patch("posts.caching.bump_page_tags") as bump:
+            call_command("repair_user_stats", stdout=StringIO())
+
+        self.assertTrue(get_stats(self.leo.pk).pulled)
+        self.assertFalse(get_stats(self.reader.pk).pulled)
+        self.assertEqual(set(bump.call_args[0][0]),
+                         {"stats:leo", "stats:reader"})
+
+
+class CheckQueryPlansTest(TestCase):
+    def test_feed_queries_use_indexes(self):
+        """Запросы лент не читают таблицы целиком и не сортируют
+        во временном B-дереве"""
+        call_command("check_query_plans", stdout=StringIO())
+
+    def test_cursor_query_walking_index_fails(self):
+        """Запрос от курсора, проходящий индекс с начала, — ошибка"""
+        plan = ["SCAN posts_post USING INDEX post_pub_date_idx"]
+        with mock.patch(
+            "posts.management.commands.check_query_plans.explain",
+            return_value=plan,
+        ):
+            with self.assertRaisesMessage(CommandError, "курсор вперед"):
+                call_command("check_query_plans", stdout=StringIO())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(dir=settings.BASE_DIR))
+class RebuildThumbnailsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.leo = User.objects.create_user(username="leo")
+        gif = (
+            b"\x47\x49\x46\x38\x39\x61\x02\x00"
+            b"\x01\x00\x80\x00\x00\x00\x00\x00"
+            b"\xFF\xFF\xFF\x21\xF9\x04\x00\x00"
+            b"\x00\x00\x00\x2C\x00\x00\x00\x00"
+            b"\x02\x00\x01\x00\x00\x02\x02\x0C"
+            b"\x0A\x00\x3B"
+        )
+        cls.first, cls.second = [
+            Post.objects.create(
+                text="Пост", author=cls.leo, thumbnails_ready=False,
+                image=SimpleUploadedFile(name, gif, content_type="image/gif"),
+            )
+            for name in ("first.gif", "second.gif")
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_rebuild_thumbnails_prepares_variants(self):
+        """Команда rebuild_thumbnails готовит все варианты картинок"""
+        out = StringIO()
+        call_command(
+            "rebuild_thumbnails", chunk_size=1, workers=1, stdout=out
+        )
+
+        posts = list(Post.objects.filter(author=self.leo))
+        resolve(posts)
+        for post in posts:
+            self.assertTrue(post.thumbnails_ready)
+            self.assertEqual(len(post.variants["WEBP"]), 3)
+            self.assertEqual(post.image_width, 2)
+            self.assertTrue(post.image_placeholder)
+        self.assertIn(f"последний id {self.second.pk}", out.getvalue())
+
+    def test_rebuild_thumbnails_resumes_after_id(self):
+        call_command(
+            "rebuild_thumbnails", start_after=self.first.pk, workers=1,
+            stdout=StringIO(),
+        )
+
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertFalse(self.first.thumbnails_ready)
+        self.assertTrue(self.second.thumbnails_ready)
+
+    def test_rebuild_thumbnails_pending_skips_ready_posts(self):
+        """С --pending дорисовываются только неготовые посты"""
+        Post.objects.filter(pk=self.first.pk).update(thumbnails_ready=True)
+        out = StringIO()
+
+        call_command("rebuild_thumbnails", pending=True, workers=1,
+                     stdout=out)
+
+        self.second.refresh_from_db()
+        self.assertTrue(self.second.thumbnails_ready)
+        self.assertIn("Готово: 1 постов", out.getvalue())
+
+    def test_generate_decodes_image_once(self):
+        """Все варианты картинки рисуются за одно декодирование"""
+        with mock.patch.object(
+            default.engine, "get_image", wraps=default.engine.get_image
+        ) as get_image:
+            generate(self.first.pk)
+
+        self.assertEqual(get_image.call_count, 1)
+        self.first.refresh_from_db()
+        self.assertTrue(self.first.thumbnails_ready)
+        resolve([self.first])
+        self.assertEqual(len(self.first.variants["WEBP"]), 3)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(dir=settings.BASE_DIR))
+class CollectOrphanedMediaTest(TestCase):
+    def setUp(self):
+        leo = User.objects.create_user(username="leo")
+        gif = (
+            b"\x47\x49\x46\x38\x39\x61\x02\x00"
+            b"\x01\x00\x80\x00\x00\x00\x00\x00"
+            b"\xFF\xFF\xFF\x21\xF9\x04\x00\x00"
+            b"\x00\x00\x00\x2C\x00\x00\x00\x00"
+            b"\x02\x00\x01\x00\x00\x02\x02\x0C"
+            b"\x0A\x00\x3B"
+        )
+        self.post = Post.objects.create(
+            text="Пост", author=leo,
+            image=SimpleUploadedFile("pic.gif", gif, content_type="image/gif"),
+        )
+        generate(self.post.pk)
+        self.orphans = [
+            os.path.join(settings.MEDIA_ROOT, "posts", "old.gif"),
+            os.path.join(settings.MEDIA_ROOT, "cache", "ab", "cd", "old.jpg"),
+        ]
+        for path in self.orphans:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as orphan:
+                orphan.write(gif)
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def media_files(self):
+        return {
+            os.path.join(root, name)
+            for root, _, names in os.walk(settings.MEDIA_ROOT)
+            for name in names
+        }
+
+    def test_dry_run_changes_nothing(self):
+        files = self.media_files()
+        out = StringIO()
+
+        call_command(
+            "collect_orphaned_media", min_age=0, dry_run=True, stdout=out
+        )
+
+        self.assertEqual(self.media_files(), files)
+        self.assertIn("Найдено лишних: 2", out.getvalue())
+
+    def test_orphans_are_removed(self):
+        """Удаляются только файлы, на которые никто не ссылается"""
+        files = self.media_files()
+
+        call_command(
+            "collect_orphaned_media", min_age=0, batch_size=2,
+            stdout=StringIO(),
+        )
+
+        self.assertEqual(self.media_files(), files - set(self.orphans))
+        resolve([self.post])
+        self.assertEqual(len(self.post.variants["JPEG"]), 3)
+
+    def test_orphans_are_quarantined(self):
+        quarantine = os.path.join(settings.MEDIA_ROOT, "quarantine")
+
+        call_command(
+            "collect_orphaned_media", min_age=0, quarantine=quarantine,
+            stdout=StringIO(),
+        )
+
+        self.assertTrue(
+            os.path.exists(os.path.join(quarantine, "posts", "old.gif"))
+        )
+        self.assertFalse(os.path.exists(self.orphans[0]))
+
+    def test_recent_files_are_kept(self):
+        files = self.media_files()
+
+        call_command("collect_orphaned_media", stdout=StringIO())
+
+        self.assertEqual(self.media_files(), files)
@@ -1,14 +1,22 @@
+import hashlib
+import os
 import shutil
 import tempfile
+from io import BytesIO
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
 from ..forms import PostForm
-from ..models import Group, Post
+from ..images import delete_unreferenced
+from ..models import Group, Post, StoredImage
+from ..thumbnails import generate
 
 User = get_user_model()
 
@@ -31,6 +39,14 @@ class PostCreateFormTests(TestCase):
             author=cls.tolstoy,
         )
         cls.form = PostForm()
+        cls.small_gif = (
+            b"\x47\x49\x46\x38\x39\x61\x02\x00"
+            b"\x01\x00\x80\x00\x00\x00\x00\x00"
+            b"\xFF\xFF\xFF\x21\xF9\x04\x00\x00"
+            b"\x00\x00\x00\x2C\x00\x00\x00\x00"
+            b"\x02\x00\x01\x00\x00\x02\x02\x0C"
+            b"\x0A\x00\x3B"
+        )
 
     @classmethod
     def tearDownClass(cls):
@@ -43,6 +59,7 @@ class PostCreateFormTests(TestCase):
         self.mihailov_authorized_client.force_login(
             PostCreateFormTests.mihailov)
         self.tolstoy_authorized_client.force_login(PostCreateFormTests.tolstoy)
+        cache.clear()
 
     def test_create_post(self):
         posts_count = Post.objects.count()
@@ -148,12 +165,199 @@ class PostCreateFormTests(TestCase):
             reverse("new_post"), data=form_data, follow=True
         )
 
+        digest = hashlib.sha256(gif).hexdigest()
         self.assertRedirects(response, reverse("index"))
         self.assertEqual(Post.objects.count(), posts_count + 1)
         self.assertTrue(
             Post.objects.filter(
                 text="Пост Стаса с картинкой",
                 author=PostCreateFormTests.mihailov,
-                image="posts/pic.gif",
+                image=f"posts/{digest[:2]}/{digest[2:4]}/{digest}.gif",
             ).exists()
         )
+
+    def test_duplicate_image_is_stored_once(self):
+        """Одинаковые картинки хранятся одним файлом со счетчиком ссылок"""
+        for name in ("first.gif", "second.gif"):
+            self.mihailov_authorized_client.post(
+                reverse("new_post"),
+                data={
+                    "text": "Повтор",
+                    "image": SimpleUploadedFile(
+                        name, self.small_gif, content_type="image/gif"
+                    ),
+                },
+            )
+        first, second = Post.objects.filter(text="Повтор")
+        name = first.image.name
+
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(StoredImage.objects.get(name=name).refs, 2)
+
+        first.delete()
+        self.assertEqual(StoredImage.objects.get(name=name).refs, 1)
+
+        second.delete()
+        self.assertFalse(StoredImage.objects.filter(name=name).exists())
+        # Файл удаляется после коммита, в тесте вызываем это сами.
+        self.assertTrue(os.path.exists(second.image.path))
+        delete_unreferenced(name)
+        self.assertFalse(os.path.exists(second.image.path))
+
+    def test_reused_file_survives_pending_delete(self):
+        """Файл, который удаляется после коммита, не пропадает, если его
+        загрузили снова"""
+        upload = {"text": "Повтор", "image": SimpleUploadedFile(
+            "first.gif", self.small_gif, content_type="image/gif"
+        )}
+        self.mihailov_authorized_client.post(reverse("new_post"), upload)
+        Post.objects.get(text="Повтор").delete()
+        storage = Post.image.field.storage
+        exists = storage.exists
+
+        def exists_then_delete(name):
+            # Удаление прежней транзакции идет между проверкой файла
+            # и сохранением поста.
+            found = exists(name)
+            delete_unreferenced(name)
+            return found
+        upload["image"] = SimpleUploadedFile(
+            "second.gif", self.small_gif, content_type="image/gif"
+        )
+        with mock.patch.object(storage, "exists", exists_then_delete):
+            self.mihailov_authorized_client.post(reverse("new_post"), upload)
+
+        post = Post.objects.get(text="Повтор")
+        self.assertTrue(os.path.exists(post.image.path))
+        self.assertEqual(StoredImage.objects.get(name=post.image.name).refs, 1)
+
+    def test_new_image_thumbnails_are_prepared_in_background(self):
+        """Новая картинка помечает пост до готовности миниатюр"""
+        picture = SimpleUploadedFile(
+            name="thumb.gif", content=self.small_gif, content_type="image/gif"
+        )
+        self.mihailov_authorized_client.post(
+            reverse("new_post"),
+            data={"text": "Пост с миниатюрой", "image": picture},
+        )
+        post = Post.objects.get(text="Пост с миниатюрой")
+        self.assertFalse(post.thumbnails_ready)
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        self.assertTrue(
+            post.image_placeholder.startswith("data:image/webp;base64,")
+        )
+        response = self.mihailov_authorized_client.get(reverse("index"))
+        self.assertContains(response, post.image_placeholder)
+
+        generate(post.pk)
+
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnails_ready)
+
+    def jpeg(self, size, orientation=None):
+        image = Image.new("RGB", size, "red")
+        exif = Image.Exif()
+        if orientation:
+            exif[0x0112] = orientation
+        output = BytesIO()
+        image.save(output, "JPEG", exif=exif.tobytes())
+        return SimpleUploadedFile(
+            "photo.jpg", output.getvalue(), content_type="image/jpeg"
+        )
+
+    @override_settings(POST_IMAGE_MAX_SIDE=100)
+    def test_large_image_is_downscaled_without_exif(self):
+        """Крупная картинка уменьшается, EXIF с нее снимается"""
+        form = PostForm(
+            data={"text": "Фото"},
+            files={"image": self.jpeg((400, 200), orientation=6)},
+        )
+
+        self.assertTrue(form.is_valid(), form.errors)
+        image = Image.open(form.cleaned_data["image"])
+        self.assertEqual(image.size, (50, 100))
+        self.assertNotIn("exif", image.info)
+
+    def test_small_image_is_stored_as_is(self):
+        """Картинка в пределах ограничений не перекодируется"""
+        picture = SimpleUploadedFile(
+            "pic.gif", self.small_gif, content_type="image/gif"
+        )
+        form = PostForm(data={"text": "Гиф"}, files={"image": picture})
+
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertIs(form.cleaned_data["image"], picture)
+
+    def animation(self, size, image_format="WEBP", exif=True):
+        frames = [Image.new("RGB", size, color) for color in ("red", "blue")]
+        output = BytesIO()
+        options = {"exif": Image.Exif().tobytes()} if exif else {}
+        frames[0].save(
+            output, image_format, save_all=True, append_images=frames[1:],
+            **options
+        )
+        return SimpleUploadedFile(
+            f"animation.{image_format.lower()}", output.getvalue(),
+            content_type=Image.MIME[image_format],
+        )
+
+    def test_small_animation_is_stored_without_exif(self):
+        """Небольшая анимация сохраняется целиком, но без EXIF"""
+        for image_format in ("WEBP", "GIF"):
+            with self.subTest(image_format=image_format):
+                form = PostForm(
+                    data={"text": "Анимация"},
+                    files={"image": self.animation((50, 50), image_format)},
+                )
+
+                self.assertTrue(form.is_valid(), form.errors)
+                image = Image.open(form.cleaned_data["image"])
+                self.assertEqual(image.format, image_format)
+                self.assertEqual(image.size, (50, 50))
+                self.assertEqual(image.n_frames, 2)
+                self.assertNotIn("exif", image.info)
+
+    @override_settings(POST_IMAGE_MAX_SIDE=100)
+    def test_large_animation_is_rejected(self):
+        form = PostForm(
+            data={"text": "Анимация"},
+            files={"image": self.animation((200, 50))},
+        )
+
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors.as_data()["image"][0].code,
+                         "animation_too_large")
+
+    @override_settings(POST_IMAGE_MAX_SIDE=100)
+    def test_multi_picture_jpeg_keeps_first_frame(self):
+        """Из MPO с камеры остается первый кадр в JPEG без EXIF"""
+        form = PostForm(
+            data={"text": "Фото"},
+            files={"image": self.animation((300, 200), "MPO")},
+        )
+
+        self.assertTrue(form.is_valid(), form.errors)
+        image = Image.open(form.cleaned_data["image"])
+        self.assertEqual(image.format, "JPEG")
+        self.assertEqual(image.size, (100, 67))
+        self.assertNotIn("exif", image.info)
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=100)
+    def test_image_over_pixel_limit_is_rejected(self):
+        form = PostForm(
+            data={"text": "Фото"}, files={"image": self.jpeg((20, 20))}
+        )
+
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors.as_data()["image"][0].code,
+                         "too_many_pixels")
+
+    @override_settings(POST_IMAGE_MAX_BYTES=10)
+    def test_image_over_size_limit_is_rejected(self):
+        form = PostForm(
+            data={"text": "Фото"}, files={"image": self.jpeg((20, 20))}
+        )
+
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors.as_data()["image"][0].code,
+                         "file_too_large")
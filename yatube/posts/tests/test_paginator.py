@@ -1,9 +1,10 @@
 from django.core.cache import cache
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.test import Client, SimpleTestCase, TestCase, override_settings
 from django.urls import reverse
 
 from ..models import Post
+from ..paginators import page_window
 
 User = get_user_model()
 
@@ -31,3 +32,69 @@ class PaginatorViewsTest(TestCase):
     def test_second_page_contains_three_records(self):
         response = self.client.get(reverse("index") + "?page=2")
         self.assertEqual(len(response.context["page"].object_list), 3)
+
+    def test_next_cursor_leads_to_second_page(self):
+        """Курсор следующей страницы отдает оставшиеся записи"""
+        first_page = self.client.get(reverse("index")).context["page"]
+        response = self.client.get(
+            reverse("index"), {"cursor": first_page.next_cursor}
+        )
+        page = response.context["page"]
+
+        self.assertEqual(page.number, 2)
+        self.assertEqual([post.id for post in page], [3, 2, 1])
+        self.assertIsNone(page.next_cursor)
+
+    def test_previous_cursor_returns_first_page(self):
+        """Курсор предыдущей страницы возвращает к первой странице"""
+        first_page = self.client.get(reverse("index")).context["page"]
+        second_page = self.client.get(
+            reverse("index"), {"cursor": first_page.next_cursor}
+        ).context["page"]
+        response = self.client.get(
+            reverse("index"), {"cursor": second_page.previous_cursor}
+        )
+        page = response.context["page"]
+
+        self.assertEqual(page.number, 1)
+        self.assertEqual(list(page), list(first_page))
+        self.assertFalse(page.has_previous())
+
+    def test_broken_cursor_returns_first_page(self):
+        response = self.client.get(reverse("index"), {"cursor": "broken"})
+
+        self.assertEqual(response.context["page"].number, 1)
+        self.assertEqual(len(response.context["page"].object_list), 10)
+
+    def test_page_out_of_range_returns_last_page(self):
+        """Номер за концом ленты отдает последнюю страницу"""
+        response = self.client.get(reverse("index") + "?page=50")
+        page = response.context["page"]
+
+        self.assertEqual(page.number, 2)
+        self.assertEqual(len(page.object_list), 3)
+
+    @override_settings(POSTS_PER_PAGE=2, PAGINATOR_WINDOW=1)
+    def test_page_links_are_windowed(self):
+        """Навигация показывает только окно вокруг текущей страницы"""
+        response = self.client.get(reverse("index"), {"page": 4})
+
+        self.assertContains(response, "?page=1")
+        self.assertContains(response, "?page=7")
+        self.assertNotContains(response, "?page=2")
+        self.assertNotContains(response, "?page=6")
+        self.assertContains(response, "&hellip;", count=2)
+
+
+class PageWindowTest(SimpleTestCase):
+    def test_page_window(self):
+        cases = (
+            ((1, 1, 2), [1]),
+            ((1, 10, 2), [1, 2, 3, None, 10]),
+            ((5, 10, 1), [1, None, 4, 5, 6, None, 10]),
+            ((10, 10, 2), [1, None, 8, 9, 10]),
+            ((3, 5, 2), [1, 2, 3, 4, 5]),
+        )
+        for args, expected in cases:
+            with self.subTest(args=args):
+                self.assertEqual(page_window(*args), expected)
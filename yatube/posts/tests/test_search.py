@@ -0,0 +1,54 @@
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import Post
+
+User = get_user_model()
+
+
+class SearchViewTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="pass"
+        )
+        cls.leo = User.objects.create_user(username="leo")
+        cls.war = Post.objects.create(text="Война и мир", author=cls.leo)
+        cls.anna = Post.objects.create(text="Анна Каренина", author=cls.leo)
+
+    def test_search_finds_matching_posts(self):
+        """Поиск находит посты по словам и их началу"""
+        response = self.client.get(reverse("search"), {"q": "вой"})
+
+        self.assertEqual(list(response.context["page"]), [self.war])
+
+    def test_search_follows_post_edits(self):
+        """Индекс поиска обновляется при правке и удалении поста"""
+        self.anna.text = "Воскресение"
+        self.anna.save()
+        response = self.client.get(reverse("search"), {"q": "Воскресение"})
+        self.assertEqual(list(response.context["page"]), [self.anna])
+
+        self.anna.delete()
+        response = self.client.get(reverse("search"), {"q": "Воскресение"})
+        self.assertEqual(len(response.context["page"].object_list), 0)
+
+    def test_search_ignores_query_syntax(self):
+        """Служебные символы FTS5 в запросе не ломают поиск"""
+        response = self.client.get(reverse("search"), {"q": '"мир* ('})
+
+        self.assertEqual(list(response.context["page"]), [self.war])
+
+    def test_admin_search_uses_index(self):
+        admin_client = Client()
+        admin_client.force_login(self.admin)
+
+        response = admin_client.get(
+            reverse("admin:posts_post_changelist"), {"q": "Каренина"}
+        )
+
+        self.assertEqual(
+            list(response.context["cl"].result_list), [self.anna]
+        )
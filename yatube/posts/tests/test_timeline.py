@@ -0,0 +1,153 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Follow, Post, TimelineEntry
+from ..timeline import follow_feed
+
+User = get_user_model()
+
+
+class TimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.leo = User.objects.create_user(username="leo")
+        cls.reader = User.objects.create_user(username="reader")
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(TimelineTest.reader)
+
+    def test_new_post_is_fanned_out_to_followers(self):
+        """Новый пост автора попадает в ленту подписчика"""
+        Follow.objects.create(user=self.reader, author=self.leo)
+        post = Post.objects.create(text="Новый пост", author=self.leo)
+
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.reader, post=post).exists()
+        )
+
+    def test_follow_backfills_and_unfollow_prunes_timeline(self):
+        """Подписка заполняет ленту, отписка очищает ее"""
+        Post.objects.create(text="Пост 1", author=self.leo)
+        Post.objects.create(text="Пост 2", author=self.leo)
+
+        self.reader_client.get(
+            reverse("profile_follow", kwargs={"username": "leo"})
+        )
+        response = self.reader_client.get(reverse("follow_index"))
+        self.assertEqual(len(response.context["page"]), 2)
+
+        self.reader_client.get(
+            reverse("profile_unfollow", kwargs={"username": "leo"})
+        )
+        self.assertFalse(self.reader.timeline.exists())
+
+    @override_settings(TIMELINE_MAX_ENTRIES=3)
+    def test_timeline_is_capped(self):
+        """trim_timelines оставляет в ленте TIMELINE_MAX_ENTRIES записей,
+        а чтение ленты ее не обрезает"""
+        Follow.objects.create(user=self.reader, author=self.leo)
+        posts = [
+            Post.objects.create(text=f"Пост {i}", author=self.leo)
+            for i in range(5)
+        ]
+        self.reader_client.get(reverse("follow_index"))
+        self.assertEqual(self.reader.timeline.count(), 5)
+
+        call_command("trim_timelines", stdout=StringIO())
+
+        kept = self.reader.timeline.values_list("post", flat=True)
+        self.assertEqual(
+            sorted(kept), sorted(post.id for post in posts[-3:])
+        )
+
+    def test_fan_out_queries_do_not_depend_on_followers(self):
+        """Раскладка поста делает одинаково запросов при любом числе
+        подписчиков"""
+        Follow.objects.create(user=self.reader, author=self.leo)
+        with CaptureQueriesContext(connection) as one_follower:
+            Post.objects.create(text="Пост", author=self.leo)
+        for i in range(5):
+            follower = User.objects.create_user(username=f"follower{i}")
+            Follow.objects.create(user=follower, author=self.leo)
+
+        with CaptureQueriesContext(connection) as many_followers:
+            Post.objects.create(text="Пост", author=self.leo)
+
+        self.assertEqual(len(many_followers), len(one_follower))
+
+
+@override_settings(FANOUT_FOLLOWER_THRESHOLD=1, POSTS_PER_PAGE=3)
+class HybridFeedTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.leo = User.objects.create_user(username="leo")
+        cls.star = User.objects.create_user(username="star")
+        cls.reader = User.objects.create_user(username="reader")
+        fan = User.objects.create_user(username="fan")
+        Follow.objects.create(user=fan, author=cls.star)
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(HybridFeedTest.reader)
+        Follow.objects.create(user=self.reader, author=self.leo)
+        Follow.objects.create(user=self.reader, author=self.star)
+        self.posts = [
+            Post.objects.create(text=f"Пост {i}", author=author)
+            for i, author in enumerate([self.leo, self.star] * 3)
+        ]
+
+    def test_popular_author_posts_are_not_fanned_out(self):
+        """Посты популярного автора не пишутся в ленты подписчиков"""
+        self.assertFalse(
+            self.reader.timeline.filter(post__author=self.star).exists()
+        )
+
+    def test_feed_merges_pulled_and_pushed_posts(self):
+        """Лента подписок сливает оба потока в порядке публикации"""
+        first_page = self.reader_client.get(
+            reverse("follow_index")
+        ).context["page"]
+        second_page = self.reader_client.get(
+            reverse("follow_index"), {"cursor": first_page.next_cursor}
+        ).context["page"]
+
+        self.assertEqual(
+            list(first_page) + list(second_page), self.posts[::-1]
+        )
+        self.assertIsNone(second_page.next_cursor)
+
+    def test_author_below_threshold_stays_pulled(self):
+        """Посты автора не пропадают, когда подписчиков стало меньше порога"""
+        Follow.objects.filter(author=self.star).exclude(
+            user=self.reader
+        ).delete()
+
+        response = self.reader_client.get(reverse("follow_index"))
+
+        self.assertIn(self.posts[-1], list(response.context["page"]))
+        post = Post.objects.create(text="Новый пост", author=self.star)
+        self.assertFalse(self.reader.timeline.filter(post=post).exists())
+
+    def test_pulled_authors_are_read_in_one_query(self):
+        """Число запросов ленты не растет с числом популярных авторов"""
+        with CaptureQueriesContext(connection) as one_author:
+            follow_feed(self.reader, 3).get_page()
+        second_star = User.objects.create_user(username="second_star")
+        for user in (self.reader, self.leo):
+            Follow.objects.create(user=user, author=second_star)
+        post = Post.objects.create(text="Новый пост", author=second_star)
+
+        with CaptureQueriesContext(connection) as two_authors:
+            page = follow_feed(self.reader, 3).get_page()
+
+        self.assertEqual(len(two_authors), len(one_author))
+        self.assertEqual(list(page), [post, *self.posts[:-3:-1]])
@@ -1,3 +1,4 @@
+import os
 import shutil
 import tempfile
 
@@ -5,11 +6,17 @@ from django.conf import settings
 from django.core.cache import cache
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.db import transaction
+from django.test import (
+    Client, TestCase, TransactionTestCase, override_settings
+)
 from django.urls import reverse
 from django import forms
 
-from ..models import Post, Group
+from .. import caching
+from ..models import Comment, Follow, Group, Post
+from ..thumbnails import generate as generate_thumbnails
+from ..thumbnails import resolve as resolve_thumbnails
 
 User = get_user_model()
 TEST_DIR = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -68,6 +75,7 @@ class YatubePagesTest(TestCase):
             shutil.rmtree(TEST_DIR)
         except OSError:
             pass
+        super().tearDownClass()
 
     def setUp(self):
         self.mihailov_client = Client()
@@ -252,18 +260,50 @@ class YatubePagesTest(TestCase):
             self.test_post_with_image.image
         )
 
+    def test_thumbnails_are_resolved_in_one_query(self):
+        """Варианты картинок страницы берутся из KV store одним запросом"""
+        post = YatubePagesTest.test_post_with_image
+        generate_thumbnails(post.pk)
+        cache.clear()
+        posts = list(Post.objects.filter(image__gt=""))
 
-class CacheTest(TestCase):
-    @classmethod
-    def setUpClass(cls):
-        super().setUpClass()
+        with self.assertNumQueries(1):
+            resolve_thumbnails(posts)
+
+        self.assertEqual(set(posts[0].variants), {"WEBP", "JPEG"})
+        self.assertEqual(
+            [image.width for image in posts[0].variants["WEBP"]],
+            [320, 640, 960],
+        )
+        self.assertTrue(posts[0].variants["WEBP"][0].url.endswith(".webp"))
+        self.assertTrue(posts[0].thumbnail.url.endswith(".jpg"))
+        self.assertEqual(
+            (posts[0].thumbnail.width, posts[0].thumbnail.height), (960, 600)
+        )
+
+    def test_post_image_has_responsive_variants(self):
+        """Картинка поста выводится с srcset в WebP и JPEG"""
+        post = YatubePagesTest.test_post_with_image
+        generate_thumbnails(post.pk)
+        cache.clear()
+        response = self.mihailov_client.get(
+            reverse("post", args=[post.author.username, post.id])
+        )
 
-        cls.mihailov = User.objects.create_user(id=2,
-                                                username="StasMihailov")
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, 'width="960" height="600"')
+        self.assertContains(response, " 320w, ", count=2)
+
+
+class CacheTest(TransactionTestCase):
+    """Кэш сбрасывается после коммита, поэтому тесты коммитят данные."""
 
     def setUp(self):
+        self.mihailov = User.objects.create_user(id=2,
+                                                 username="StasMihailov")
         self.mihailov_client = Client()
-        self.mihailov_client.force_login(CacheTest.mihailov)
+        self.mihailov_client.force_login(self.mihailov)
         cache.clear()
 
     def test_cache(self):
@@ -271,7 +311,7 @@ class CacheTest(TestCase):
 
         Post.objects.create(
             text="Второй пост для теста кэша",
-            author=CacheTest.mihailov,
+            author=self.mihailov,
         )
         post_count = len(response.context["page"].object_list)
         self.assertEqual(len(response.context["page"].object_list), post_count)
@@ -284,3 +324,315 @@ class CacheTest(TestCase):
         )
         self.assertEqual(len(second_response.context["page"].object_list),
                          post_count_after_clear)
+
+    def test_new_post_invalidates_index_cache(self):
+        """Новый пост сразу виден на закэшированной главной странице"""
+        self.mihailov_client.get(reverse("index"))
+
+        Post.objects.create(
+            text="Пост после кэширования",
+            author=self.mihailov,
+        )
+        response = self.mihailov_client.get(reverse("index"))
+
+        self.assertContains(response, "Пост после кэширования")
+
+    def test_cached_index_shows_edit_button_only_to_author(self):
+        """Кнопка редактирования из общего кэша видна только автору"""
+        Post.objects.create(text="Пост Стаса", author=self.mihailov)
+        self.mihailov_client.get(reverse("index"))
+
+        guest_response = self.client.get(reverse("index"))
+        author_response = self.mihailov_client.get(reverse("index"))
+
+        self.assertNotContains(guest_response, "Редактировать")
+        self.assertContains(author_response, "Редактировать")
+
+    def test_post_card_is_refreshed_after_comment(self):
+        """Карточка поста в ленте обновляется после нового комментария"""
+        post = Post.objects.create(text="Пост", author=self.mihailov)
+        url = reverse("profile", kwargs={"username": "StasMihailov"})
+        self.assertNotContains(self.client.get(url), "Комментариев: 1")
+
+        Comment.objects.create(
+            post=post, author=self.mihailov, text="Комментарий"
+        )
+
+        self.assertContains(self.client.get(url), "Комментариев: 1")
+
+    def test_post_cards_are_rendered_from_cache(self):
+        """Повторный показ ленты берет карточки из кэша"""
+        Post.objects.create(text="Пост", author=self.mihailov)
+        url = reverse("profile", kwargs={"username": "StasMihailov"})
+        self.client.get(url)
+
+        with self.assertTemplateNotUsed("posts/post_item.html"):
+            response = self.client.get(url)
+        self.assertContains(response, "Пост")
+
+
+class SharedPageCacheTest(TransactionTestCase):
+    def setUp(self):
+        self.leo = User.objects.create_user(username="leo")
+        self.reader = User.objects.create_user(username="reader")
+        self.post = Post.objects.create(text="Пост", author=self.leo)
+        self.profile_url = reverse("profile", kwargs={"username": "leo"})
+        self.post_url = reverse(
+            "post", kwargs={"username": "leo", "post_id": self.post.id}
+        )
+        cache.clear()
+
+    def test_repeated_page_is_served_without_queries(self):
+        """Повторная страница для гостя не обращается к базе"""
+        self.client.get(self.profile_url)
+
+        with self.assertNumQueries(0), \
+                self.assertTemplateNotUsed("posts/profile.html"):
+            response = self.client.get(self.profile_url)
+        self.assertContains(response, "Пост")
+
+    def test_query_string_is_part_of_key(self):
+        """Страницы с разными параметрами кэшируются отдельно"""
+        self.client.get(self.profile_url)
+
+        with self.assertTemplateUsed("posts/profile.html"):
+            self.client.get(self.profile_url, {"page": 2})
+
+    def test_holes_are_filled_for_each_user(self):
+        """Общая страница дорисовывается для каждого пользователя"""
+        self.client.get(self.profile_url)
+        leo_client = Client()
+        leo_client.force_login(self.leo)
+        reader_client = Client()
+        reader_client.force_login(self.reader)
+
+        with self.assertTemplateNotUsed("posts/profile.html"):
+            leo_response = leo_client.get(self.profile_url)
+            reader_response = reader_client.get(self.profile_url)
+
+        self.assertContains(leo_response, "Пользователь: leo.")
+        self.assertContains(leo_response, "Редактировать")
+        self.assertNotContains(leo_response, "Подписаться")
+        self.assertContains(reader_response, "Пользователь: reader.")
+        self.assertContains(reader_response, "Подписаться")
+        self.assertNotContains(reader_response, "Редактировать")
+        self.assertNotContains(reader_response, "<!--hole:")
+        self.assertNotContains(reader_response, "<!--owner:")
+
+    def test_comment_form_is_filled_after_cache_hit(self):
+        """Форма комментария с CSRF есть на странице из общего кэша"""
+        self.client.get(self.post_url)
+        reader_client = Client()
+        reader_client.force_login(self.reader)
+
+        with self.assertTemplateNotUsed("posts/post.html"):
+            response = reader_client.get(self.post_url)
+
+        self.assertContains(response, "Добавить комментарий:")
+        self.assertContains(response, "csrfmiddlewaretoken")
+        self.assertNotContains(self.client.get(self.post_url),
+                               "Добавить комментарий:")
+
+    def test_comment_invalidates_post_page(self):
+        """Новый комментарий сразу виден гостю"""
+        self.client.get(self.post_url)
+
+        Comment.objects.create(
+            post=self.post, author=self.reader, text="Комментарий гостю"
+        )
+
+        self.assertContains(self.client.get(self.post_url),
+                            "Комментарий гостю")
+
+    def test_follow_invalidates_only_related_pages(self):
+        """Подписка сбрасывает страницы автора, но не главную"""
+        self.client.get(reverse("index"))
+        self.client.get(self.profile_url)
+
+        Follow.objects.create(user=self.reader, author=self.leo)
+
+        self.assertContains(self.client.get(self.profile_url),
+                            "Подписчиков: 1")
+        with self.assertTemplateNotUsed("posts/index.html"):
+            self.client.get(reverse("index"))
+
+    def test_versions_change_only_after_commit(self):
+        """Версии страниц и ленты меняются только после коммита"""
+        tags = ["feed", "author:leo", f"post:{self.post.pk}"]
+        page_versions = caching.page_tag_versions(tags)
+        feed_version = caching.feed_version()
+
+        with transaction.atomic():
+            self.post.text = "Правка"
+            self.post.save()
+            self.assertEqual(caching.page_tag_versions(tags), page_versions)
+            self.assertEqual(caching.feed_version(), feed_version)
+
+        self.assertNotEqual(caching.page_tag_versions(tags), page_versions)
+        self.assertNotEqual(caching.feed_version(), feed_version)
+
+
+class ConditionalGetTest(TransactionTestCase):
+    def setUp(self):
+        self.leo = User.objects.create_user(username="leo")
+        self.post = Post.objects.create(text="Пост", author=self.leo)
+        self.post_url = reverse(
+            "post", kwargs={"username": "leo", "post_id": self.post.id}
+        )
+        cache.clear()
+
+    def test_unchanged_page_is_not_modified(self):
+        """Неизменившаяся страница отдается ответом 304 без запросов"""
+        response = self.client.get(self.post_url)
+        self.assertIn("no-cache", response["Cache-Control"])
+
+        with self.assertNumQueries(0):
+            etag_response = self.client.get(
+                self.post_url, HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+            date_response = self.client.get(
+                self.post_url,
+                HTTP_IF_MODIFIED_SINCE=response["Last-Modified"],
+            )
+
+        self.assertEqual(etag_response.status_code, 304)
+        self.assertEqual(date_response.status_code, 304)
+
+    def test_comment_changes_validators(self):
+        """После комментария страница отдается заново"""
+        etag = self.client.get(self.post_url)["ETag"]
+
+        Comment.objects.create(post=self.post, author=self.leo, text="Текст")
+        response = self.client.get(self.post_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Текст")
+
+    def test_etag_depends_on_user(self):
+        """Авторизованный пользователь не получает 304 на ETag гостя"""
+        etag = self.client.get(self.post_url)["ETag"]
+        leo_client = Client()
+        leo_client.force_login(self.leo)
+
+        response = leo_client.get(self.post_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_personal_page_has_no_last_modified(self):
+        """По одной дате изменения пользователь 304 не получает"""
+        last_modified = self.client.get(self.post_url)["Last-Modified"]
+        leo_client = Client()
+        leo_client.force_login(self.leo)
+
+        response = leo_client.get(
+            self.post_url, HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Last-Modified"))
+        self.assertTrue(response.has_header("ETag"))
+
+    def test_relogin_changes_etag(self):
+        """После повторного входа страница с формой отдается заново"""
+        self.leo.set_password("password")
+        self.leo.save()
+        credentials = {"username": "leo", "password": "password"}
+        self.client.post(reverse("login"), credentials)
+        etag = self.client.get(self.post_url)["ETag"]
+
+        self.client.logout()
+        self.client.post(reverse("login"), credentials)
+        response = self.client.get(self.post_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "csrfmiddlewaretoken")
+
+
+class FeedQueriesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.leo = User.objects.create_user(username="leo")
+        group = Group.objects.create(
+            title="Группа", slug="group", description="Описание"
+        )
+        for i in range(10):
+            post = Post.objects.create(
+                text=f"Пост {i}", author=cls.leo, group=group
+            )
+            Comment.objects.create(post=post, author=cls.leo, text="Текст")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_feed_query_count_does_not_depend_on_posts(self):
+        """Число запросов ленты не растет с числом постов на странице"""
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse("group_posts", kwargs={"slug": "group"})
+            )
+        self.assertContains(response, "Комментариев: 1", count=10)
+
+
+@override_settings(MEDIA_ROOT=TEST_DIR + "/media")
+class MediaTest(TestCase):
+    digest = "ab" * 32
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.hashed = f"posts/ab/ab/{cls.digest}.gif"
+        for name in (cls.hashed, "posts/old.gif"):
+            path = os.path.join(settings.MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as media:
+                media.write(b"GIF89a")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_hashed_file_is_immutable(self):
+        response = self.client.get(settings.MEDIA_URL + self.hashed)
+
+        self.assertEqual(b"".join(response.streaming_content), b"GIF89a")
+        self.assertEqual(response["Content-Type"], "image/gif")
+        self.assertEqual(response["ETag"], f'"{self.digest}"')
+        self.assertIn("immutable", response["Cache-Control"])
+
+        response = self.client.get(
+            settings.MEDIA_URL + self.hashed,
+            HTTP_IF_NONE_MATCH=f'"{self.digest}"',
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_unhashed_file_is_revalidated(self):
+        response = self.client.get(settings.MEDIA_URL + "posts/old.gif")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("immutable", response["Cache-Control"])
+
+    @override_settings(MEDIA_ACCEL="x-accel-redirect")
+    def test_accel_redirect_leaves_bytes_to_proxy(self):
+        response = self.client.get(settings.MEDIA_URL + self.hashed)
+
+        self.assertEqual(
+            response["X-Accel-Redirect"], "/protected-media/" + self.hashed
+        )
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["Content-Type"], "image/gif")
+
+    @override_settings(MEDIA_ACCEL="x-sendfile")
+    def test_sendfile_points_to_file(self):
+        response = self.client.get(settings.MEDIA_URL + self.hashed)
+
+        self.assertEqual(
+            response["X-Sendfile"],
+            os.path.join(settings.MEDIA_ROOT, self.hashed),
+        )
+
+    def test_paths_outside_media_root_are_not_served(self):
+        response = self.client.get(settings.MEDIA_URL + "../manage.py")
+        self.assertEqual(response.status_code, 404)
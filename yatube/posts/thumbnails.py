@@ -0,0 +1,211 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, serialize_image_file
+
+from . import caching
+from .images import describe
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+_executor = None
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            thread_name_prefix="thumbnails",
+        )
+    return _executor
+
+
+def variant_size(width):
+    """Размер варианта заданной ширины с пропорциями POST_IMAGE_RATIO."""
+    ratio_width, ratio_height = settings.POST_IMAGE_RATIO
+    return width, round(width * ratio_height / ratio_width)
+
+
+def display_size(width, height):
+    """Размер крупнейшего варианта для оригинала ``width``×``height``.
+
+    Считается по размерам, сохраненным на посте, без чтения файла.
+    """
+    box_width, box_height = variant_size(max(settings.POST_IMAGE_WIDTHS))
+    options = settings.POST_IMAGE_OPTIONS
+    if options.get("crop") or not width or not height:
+        return box_width, box_height
+    scale = min(box_width / width, box_height / height)
+    if not options.get("upscale"):
+        scale = min(scale, 1)
+    return round(width * scale), round(height * scale)
+
+
+def variants():
+    """Геометрия и параметры sorl всех вариантов картинки поста.
+
+    Возвращает словарь ``{формат: [(геометрия, параметры), ...]}``,
+    ширины внутри формата идут по возрастанию.
+    """
+    return {
+        image_format: [
+            ("{}x{}".format(*variant_size(width)),
+             dict(settings.POST_IMAGE_OPTIONS, format=image_format))
+            for width in sorted(settings.POST_IMAGE_WIDTHS)
+        ]
+        for image_format in settings.POST_IMAGE_FORMATS
+    }
+
+
+def generate(post_id):
+    """Готовит все миниатюры поста и отмечает пост готовым."""
+    post = (
+        Post.objects.select_related("author", "group")
+        .filter(pk=post_id).first()
+    )
+    if post is None or not post.image:
+        return
+    source, thumbnails, info = draw(post.image.name)
+    default.kvstore.set_many({source: thumbnails})
+    # Картинку могли заменить, пока шла обработка.
+    Post.objects.filter(pk=post_id, image=post.image.name).update(
+        thumbnails_ready=True, **info
+    )
+    caching.bump_post_card_version(post_id)
+    caching.bump_feed_version()
+    caching.bump_page_tags(caching.post_page_tags(post))
+
+
+def run_in_worker(post_id):
+    close_old_connections()
+    try:
+        generate(post_id)
+    except Exception:
+        logger.exception("Не удалось подготовить миниатюры поста %s", post_id)
+    finally:
+        close_old_connections()
+
+
+def schedule(post):
+    """Ставит генерацию миниатюр в очередь после коммита транзакции.
+
+    При THUMBNAIL_WORKERS = 0 миниатюры готовятся сразу, в том же потоке.
+    """
+    if settings.THUMBNAIL_WORKERS:
+        transaction.on_commit(
+            lambda: executor().submit(run_in_worker, post.pk)
+        )
+    else:
+        transaction.on_commit(lambda: generate(post.pk))
+
+
+def thumbnail_options(source, options):
+    """Дополняет параметры так же, как sorl перед расчетом имени файла."""
+    backend = default.backend
+    options = dict(options)
+    if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault("format", backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(thumbnail_settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def thumbnail_file(image, geometry, options):
+    """ImageFile миниатюры без обращения к хранилищу и к KV store."""
+    source = ImageFile(image)
+    name = default.backend._get_thumbnail_filename(
+        source, geometry, thumbnail_options(source, options)
+    )
+    return ImageFile(name, default.storage)
+
+
+def draw(name, force=False):
+    """Рисует все варианты картинки ``name`` за одно декодирование.
+
+    К базе и KV store функция не обращается, а возвращает ImageFile
+    исходника и миниатюр для пакетной записи и поля размеров и превью
+    для поста. Готовые файлы без ``force`` не перерисовываются.
+    """
+    source = ImageFile(name, Post.image.field.storage)
+    source_image = default.engine.get_image(source)
+    try:
+        source.set_size(default.engine.get_image_size(source_image))
+        image_info = default.engine.get_image_info(source_image)
+        thumbnails = []
+        for image_variants in variants().values():
+            for geometry, options in image_variants:
+                thumbnail = thumbnail_file(source, geometry, options)
+                if force or not thumbnail.exists():
+                    default.backend._create_thumbnail(
+                        source_image, geometry,
+                        dict(thumbnail_options(source, options),
+                             image_info=image_info),
+                        thumbnail,
+                    )
+                else:
+                    thumbnail.set_size()
+                thumbnails.append(thumbnail)
+        # После миниатюр: describe может уменьшить картинку через draft.
+        info = describe(source_image)
+    finally:
+        default.engine.cleanup(source_image)
+    return source, thumbnails, info
+
+
+def render(name, force=False):
+    """``draw`` для процесса-воркера: ImageFile возвращаются
+    сериализованными."""
+    source, thumbnails, info = draw(name, force)
+    return (
+        serialize_image_file(source),
+        [serialize_image_file(thumbnail) for thumbnail in thumbnails],
+        info,
+    )
+
+
+def resolve(posts):
+    """Проставляет постам готовые варианты картинки.
+
+    ``post.variants`` — словарь ``{формат: [ImageFile, ...]}`` по
+    возрастанию ширины, ``post.thumbnail`` — самый крупный вариант
+    запасного формата. Записи всех вариантов страницы читаются из
+    KV store одним пакетом; если вариантов еще нет, атрибуты не
+    ставятся.
+    """
+    files = {
+        post.pk: {
+            image_format: [thumbnail_file(post.image, geometry, options)
+                           for geometry, options in image_variants]
+            for image_format, image_variants in variants().items()
+        }
+        for post in posts if post.image and post.thumbnails_ready
+    }
+    stored = default.kvstore.get_many(
+        thumbnail
+        for post_files in files.values()
+        for thumbnails in post_files.values()
+        for thumbnail in thumbnails
+    )
+    fallback = settings.POST_IMAGE_FORMATS[-1]
+    for post in posts:
+        found = {
+            image_format: [stored[thumbnail.key] for thumbnail in thumbnails
+                           if thumbnail.key in stored]
+            for image_format, thumbnails in files.get(post.pk, {}).items()
+        }
+        if found.get(fallback):
+            post.variants = found
+            post.thumbnail = found[fallback][-1]
@@ -0,0 +1,107 @@
+from django.conf import settings
+
+from .models import Follow, Post, TimelineEntry, UserStats
+from .paginators import CursorPaginator, MergedPaginator, TimelinePaginator
+from .stats import get_stats
+
+
+def is_pulled(author_id):
+    """Посты автора с большим числом подписчиков читаются при показе."""
+    return get_stats(author_id).pulled
+
+
+def mark_pulled(author_id):
+    """Переводит автора на чтение при показе, когда он пересек порог.
+
+    Обратно автор не переводится: его посты, опубликованные за это
+    время, есть только в его собственной ленте.
+    """
+    UserStats.objects.filter(
+        user_id=author_id,
+        pulled=False,
+        followers_count__gt=settings.FANOUT_FOLLOWER_THRESHOLD,
+    ).update(pulled=True)
+
+
+def pulled_authors(user):
+    """Авторы из подписок пользователя, которых не раскладывают по лентам."""
+    return list(
+        Follow.objects.filter(user=user, author__stats__pulled=True)
+        .values_list("author_id", flat=True)
+    )
+
+
+def trim(user_id):
+    """Оставляет в ленте пользователя не больше TIMELINE_MAX_ENTRIES.
+
+    Вызывается при подписке и командой trim_timelines по расписанию:
+    ни публикация, ни чтение ленты не делают лишних запросов.
+    """
+    entries = TimelineEntry.objects.filter(user_id=user_id)
+    boundary = (
+        entries.order_by("-pub_date", "-id")
+        .values_list("pub_date", "id")[settings.TIMELINE_MAX_ENTRIES:]
+        .first()
+    )
+    if boundary is None:
+        return
+    pub_date, entry_id = boundary
+    entries.filter(pub_date__lt=pub_date).delete()
+    entries.filter(pub_date=pub_date, id__lte=entry_id).delete()
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if is_pulled(post.author_id):
+        return
+    follower_ids = list(
+        Follow.objects.filter(author_id=post.author_id)
+        .values_list("user_id", flat=True)
+    )
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+            for user_id in follower_ids
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user, author):
+    """Добавляет в ленту свежие посты автора, на которого подписались."""
+    if is_pulled(author.pk):
+        return
+    posts = author.posts.order_by("-pub_date", "-id").values_list(
+        "id", "pub_date"
+    )[:settings.TIMELINE_MAX_ENTRIES]
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user=user, post_id=post_id, pub_date=pub_date)
+            for post_id, pub_date in posts
+        ],
+        ignore_conflicts=True,
+    )
+    trim(user.pk)
+
+
+def prune(user, author):
+    """Убирает из ленты посты автора, от которого отписались."""
+    TimelineEntry.objects.filter(user=user, post__author=author).delete()
+
+
+def follow_feed(user, per_page):
+    """Пагинатор ленты подписок: материализованная лента плюс посты
+    популярных авторов, которые подмешиваются при чтении.
+
+    Посты всех популярных авторов читаются одним потоком по списку
+    авторов от позиции курсора, так что число запросов не зависит
+    от числа таких подписок.
+    """
+    timeline = TimelinePaginator(user.timeline.all(), per_page)
+    authors = pulled_authors(user)
+    if not authors:
+        return timeline
+    pulled = CursorPaginator(
+        Post.objects.for_feed().filter(author_id__in=authors), per_page
+    )
+    return MergedPaginator([timeline, pulled], per_page)
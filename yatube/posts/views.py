@@ -1,101 +1,151 @@
-from django.core.cache import cache
+from urllib.parse import urlencode
+
+from django.conf import settings
 from django.core.paginator import Paginator
 from django.shortcuts import render, get_object_or_404, redirect
+from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.views.decorators.http import require_http_methods, require_GET
 
+from .caching import (
+    attach_cards, cache_shared_page, feed_version, get_or_compute,
+    index_cache_key, page_viewer, personalize
+)
 from .models import Post, Group, Follow
 from .forms import PostForm, CommentForm
+from .paginators import CursorPaginator
+from .search import SearchResults
+from .thumbnails import resolve as resolve_thumbnails
+from .thumbnails import schedule as schedule_thumbnails
+from .stats import get_stats
+from .timeline import follow_feed
 
 User = get_user_model()
 
 
-def is_following(user, author):
-    return Follow.objects.filter(user=user, author=author).exists()
+def get_feed_page(request, posts, shared=False):
+    paginator = CursorPaginator(posts, settings.POSTS_PER_PAGE)
+    return get_paginated_page(request, paginator, shared)
+
+
+def get_paginated_page(request, paginator, shared=False):
+    page = paginator.get_page(
+        request.GET.get("cursor"), request.GET.get("page")
+    )
+    attach_cards(page, None if shared else page_viewer(request))
+    return page
 
 
 @require_GET
+@cache_shared_page("feed")
 def index(request):
-    page_number = request.GET.get("page")
-    cached_page = cache.get(f"index-page-{page_number}")
-    if cached_page:
-        return render(request, "posts/index.html", {"page": cached_page})
-
-    posts = Post.objects.all()
-    paginator = Paginator(posts, 10)
-    page = paginator.get_page(page_number)
-    cache.set(f"index-page-{page_number}", page, timeout=20)
-    return render(request, "posts/index.html", {"page": page})
+    computed = {}
+
+    def render_index():
+        page = get_feed_page(request, Post.objects.for_feed(), shared=True)
+        computed["page"] = page
+        return {
+            "ids": [post.id for post in page],
+            "number": page.number,
+            "next_cursor": page.next_cursor,
+            "previous_cursor": page.previous_cursor,
+            "html": render_to_string(
+                "posts/feed.html", {"page": page}
+            ),
+        }
+
+    cached = get_or_compute(
+        index_cache_key(request.GET.get("page"), request.GET.get("cursor")),
+        render_index,
+        settings.INDEX_CACHE_TIMEOUT,
+        version=feed_version(),
+    )
+    page = computed.get("page")
+    if page is None:
+        paginator = CursorPaginator(
+            Post.objects.all(), settings.POSTS_PER_PAGE
+        )
+        page = paginator.restore_page(
+            Post.objects.filter(id__in=cached["ids"]).order_by(
+                "-pub_date", "-id"
+            ),
+            cached["number"],
+            cached["next_cursor"],
+            cached["previous_cursor"],
+        )
+    context = {
+        "page": page,
+        "feed": personalize(cached["html"], page_viewer(request)),
+    }
+    return render(request, "posts/index.html", context)
 
 
 @require_GET
+@cache_shared_page("group:{slug}")
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    page = get_feed_page(request, group.posts.for_feed())
     return render(request, "posts/group.html", {"group": group, "page": page})
 
 
 @require_GET
+@cache_shared_page("author:{username}", "stats:{username}")
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
-
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
-
-    count = paginator.count
-    following = False
-    followers_count = author.following.count()
-    following_count = author.follower.count()
-    follow_button_display = request.user.username != username
-
-    if request.user.is_authenticated:
-        following = is_following(user=request.user, author=author)
+    page = get_feed_page(request, author.posts.for_feed())
 
+    stats = get_stats(author.pk)
     context = {
         "author": author,
-        "count": count,
+        "count": stats.posts_count,
         "page": page,
-        "following": following,
-        "followers_count": followers_count,
-        "following_count": following_count,
-        "follow_button_display": follow_button_display
+        "followers_count": stats.followers_count,
+        "following_count": stats.following_count,
     }
     return render(request, "posts/profile.html", context)
 
 
+@require_GET
+def search(request):
+    query = request.GET.get("q", "").strip()
+    paginator = Paginator(SearchResults(query), settings.POSTS_PER_PAGE)
+    page = paginator.get_page(request.GET.get("page"))
+    attach_cards(page, request.user)
+    context = {
+        "query": query,
+        "page": page,
+        "query_prefix": urlencode({"q": query}) + "&",
+    }
+    return render(request, "posts/search.html", context)
+
+
 @require_http_methods(["GET", "POST"])
+@cache_shared_page("post:{post_id}", "stats:{username}")
 def post_view(request, username, post_id):
     user = get_object_or_404(User, username=username)
-    count = user.posts.count()
-    post = get_object_or_404(Post, id=post_id)
-    comments = post.comments.all()
+    stats = get_stats(user.pk)
+    post = get_object_or_404(Post.objects.for_feed(), id=post_id)
+    resolve_thumbnails([post])
+    comments = post.comments.select_related("author")
     form = CommentForm(request.POST or None)
-    following = False
-    followers_count = user.following.count()
-    following_count = user.follower.count()
-    if request.user.is_authenticated:
-        following = True
     context = {
         "author": user,
         "post": post,
-        "count": count,
+        "shared": page_viewer(request) is None,
+        "count": stats.posts_count,
         "comments": comments,
         "form": form,
-        "following": following,
-        "followers_count": followers_count,
-        "following_count": following_count,
+        "followers_count": stats.followers_count,
+        "following_count": stats.following_count,
     }
     return render(request, "posts/post.html", context)
 
 
 @require_http_methods(["GET", "POST"])
 @login_required
+@transaction.atomic
 def new_post(request):
     author = request.user
     form = PostForm(request.POST or None, files=request.FILES)
@@ -104,6 +154,8 @@ def new_post(request):
         post = form.save(commit=False)
         post.author = author
         post.save()
+        if not post.thumbnails_ready:
+            schedule_thumbnails(post)
         return redirect("index")
     return render(request, "posts/new_post.html", {"form": form})
 
@@ -122,7 +174,9 @@ def post_edit(request, username, post_id):
     )
 
     if form.is_valid():
-        post.save()
+        post = form.save()
+        if not post.thumbnails_ready:
+            schedule_thumbnails(post)
         return redirect("post", username=username, post_id=post_id)
 
     context = {"form": form, "post": post, "is_edit": True}
@@ -151,16 +205,15 @@ def add_comment(request, username, post_id):
 def follow_index(request):
     user = get_object_or_404(User, username=request.user.username)
 
-    posts = Post.objects.filter(author__following__user=user)
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    paginator = follow_feed(user, settings.POSTS_PER_PAGE)
+    page = get_paginated_page(request, paginator)
 
     return render(request, "posts/follow.html", {"page": page})
 
 
 @require_http_methods(["GET", "POST"])
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     user = get_object_or_404(User, username=request.user.username)
     author = get_object_or_404(User, username=username)
@@ -171,6 +224,7 @@ def profile_follow(request, username):
 
 @require_http_methods(["GET", "POST"])
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     user = get_object_or_404(User, username=request.user.username)
     author = get_object_or_404(User, username=username)
@@ -0,0 +1,205 @@
+import os
+import tempfile
+import time
+from collections import Counter
+
+from django.core.cache import caches
+from django.core.cache.backends import filebased
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files import locks
+
+GENERATION_KEY = "tiered-cache-generation"
+INCR_LOCK = "incr.lock"
+
+_missing = object()
+# Состояние общее для всех потоков процесса, как и данные LocMemCache:
+# последняя виденная версия L2, время ее проверки и счетчики.
+_generations = {}
+_synced_at = {}
+_stats = {}
+
+
+class FileBasedCache(filebased.FileBasedCache):
+    """FileBasedCache с атомарными ``add`` и ``incr``.
+
+    В Django ``add`` проверяет ключ и записывает его двумя шагами, и два
+    процесса могут добавить один ключ одновременно. Здесь значение
+    пишется во временный файл, а на место ключа ставится через
+    ``os.link``, который не перезаписывает существующий файл. На этом
+    держится аренда пересчета в ``posts.caching.get_or_compute``.
+
+    ``incr`` в Django — это get и set, и одновременные увеличения
+    теряются, а с ними и сброс версий кэша. Здесь он идет под
+    блокировкой файла ``INCR_LOCK`` в каталоге кэша.
+    """
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._createdir()
+        fname = self._key_to_file(key, version)
+        self._cull()
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir)
+        try:
+            with open(fd, "wb") as f:
+                self._write_content(f, timeout, value)
+            # Вторая попытка — если на месте ключа лежала истекшая запись.
+            for _ in range(2):
+                try:
+                    os.link(tmp_path, fname)
+                    return True
+                except FileExistsError:
+                    try:
+                        with open(fname, "rb") as f:
+                            if not self._is_expired(f):
+                                return False
+                    except FileNotFoundError:
+                        pass
+            return False
+        finally:
+            os.remove(tmp_path)
+
+    def incr(self, key, delta=1, version=None):
+        self._createdir()
+        with open(os.path.join(self._dir, INCR_LOCK), "ab") as lock:
+            locks.lock(lock, locks.LOCK_EX)
+            try:
+                return super().incr(key, delta, version)
+            finally:
+                locks.unlock(lock)
+
+
+class TieredCache(BaseCache):
+    """Двухуровневый кэш: L1 в памяти процесса поверх общего L2.
+
+    L1 — LocMemCache, то есть LRU на MAX_ENTRIES записей, с коротким
+    L1_TIMEOUT. L2 — кэш из CACHES под алиасом OPTIONS["L2"]: локально
+    база или файлы, в продакшене memcached. Чтение идет в L1, промах —
+    в L2 с записью в L1; запись идет в оба уровня.
+
+    Согласованность между процессами держится на версии в L2: delete,
+    incr и clear увеличивают ее, а каждый процесс не реже раза
+    в SYNC_INTERVAL секунд сверяет версию и при расхождении очищает
+    свой L1. Перезапись ключа через set другим процессам видна через
+    L1_TIMEOUT, поэтому изменчивые данные адресуются версиями ключей.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.location = location or "tiered"
+        self.l2_alias = options["L2"]
+        self.l1_timeout = options.get("L1_TIMEOUT", 5)
+        self.sync_interval = options.get("SYNC_INTERVAL", 1)
+        self.l1 = LocMemCache(self.location, {
+            "TIMEOUT": self.l1_timeout,
+            "OPTIONS": {"MAX_ENTRIES": options.get("MAX_ENTRIES", 1000)},
+        })
+        self.counters = _stats.setdefault(self.location, Counter())
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def stats(self):
+        """Попадания и промахи по уровням с момента старта процесса."""
+        return {
+            tier: {
+                "hits": self.counters[f"{tier}_hits"],
+                "misses": self.counters[f"{tier}_misses"],
+            }
+            for tier in ("l1", "l2")
+        }
+
+    def sync(self):
+        now = time.monotonic()
+        if now - _synced_at.get(self.location, 0) < self.sync_interval:
+            return
+        _synced_at[self.location] = now
+        generation = self.l2.get(GENERATION_KEY)
+        if generation != _generations.get(self.location):
+            self.l1.clear()
+            _generations[self.location] = generation
+
+    def bump_generation(self):
+        try:
+            generation = self.l2.incr(GENERATION_KEY)
+        except ValueError:
+            generation = time.time_ns()
+            self.l2.set(GENERATION_KEY, generation, timeout=None)
+        # Свой L1 уже актуален, сбрасывать его не нужно.
+        _generations[self.location] = generation
+
+    def l1_backend_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self.l1_timeout
+        return min(timeout, self.l1_timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(key, value, timeout, version)
+        if added:
+            self.l1.set(key, value, self.l1_backend_timeout(timeout), version)
+        return added
+
+    def get(self, key, default=None, version=None):
+        self.sync()
+        value = self.l1.get(key, _missing, version)
+        if value is not _missing:
+            self.counters["l1_hits"] += 1
+            return value
+        self.counters["l1_misses"] += 1
+        value = self.l2.get(key, _missing, version)
+        if value is _missing:
+            self.counters["l2_misses"] += 1
+            return default
+        self.counters["l2_hits"] += 1
+        self.l1.set(key, value, self.l1_timeout, version)
+        return value
+
+    def get_many(self, keys, version=None):
+        self.sync()
+        keys = list(keys)
+        found = self.l1.get_many(keys, version)
+        self.counters["l1_hits"] += len(found)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            self.counters["l1_misses"] += len(missing)
+            fetched = self.l2.get_many(missing, version)
+            self.counters["l2_hits"] += len(fetched)
+            self.counters["l2_misses"] += len(missing) - len(fetched)
+            self.l1.set_many(fetched, self.l1_timeout, version)
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, timeout, version)
+        self.l1.set(key, value, self.l1_backend_timeout(timeout), version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, timeout, version)
+        self.l1.set_many(data, self.l1_backend_timeout(timeout), version)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        self.l2.delete(key, version)
+        self.l1.delete(key, version)
+        self.bump_generation()
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.l2.delete_many(keys, version)
+        self.l1.delete_many(keys, version)
+        self.bump_generation()
+
+    def incr(self, key, delta=1, version=None):
+        value = self.l2.incr(key, delta, version)
+        self.l1.set(key, value, self.l1_timeout, version)
+        self.bump_generation()
+        return value
+
+    def clear(self):
+        self.l2.clear()
+        self.l1.clear()
+        self.bump_generation()
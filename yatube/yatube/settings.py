@@ -140,6 +140,13 @@ STATICFILES_DIRS = ((os.path.join(BASE_DIR, "static")),)
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+# Как отдавать медиафайлы: None — сам Django, "x-accel-redirect" —
+# nginx из internal-локации MEDIA_ACCEL_PREFIX, "x-sendfile" — Apache
+# или lighttpd по абсолютному пути
+MEDIA_ACCEL = None
+MEDIA_ACCEL_PREFIX = "/protected-media/"
+# Сколько браузер хранит медиафайлы без хэша в имени
+MEDIA_CACHE_TIMEOUT = 60 * 60
 
 # Login
 
@@ -151,8 +158,75 @@ EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
 # указываем директорию, в которую будут складываться файлы писем
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
+# Двухуровневый кэш: L1 в памяти процесса поверх общего для всех
+# воркеров L2. Локально L2 — файлы в каталоге cache, в продакшене
+# его заменяют на memcached. add и incr в L2 должны быть атомарными:
+# на них держатся аренда пересчета и версии кэша, поэтому файловый
+# кэш свой
 CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    "default": {
+        "BACKEND": "yatube.cache.TieredCache",
+        "OPTIONS": {
+            "L2": "shared",
+            "L1_TIMEOUT": 5,
+            "MAX_ENTRIES": 1000,
+            "SYNC_INTERVAL": 1,
+        },
+    },
+    "shared": {
+        "BACKEND": "yatube.cache.FileBasedCache",
+        "LOCATION": os.path.join(BASE_DIR, "cache"),
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
 }
+# Тесты подменяют L2 на кэш в памяти процесса
+TEST_RUNNER = "yatube.testing.TestRunner"
+
+# Количество постов на одной странице ленты
+POSTS_PER_PAGE = 10
+
+# Сколько записей хранится в материализованной ленте подписок пользователя;
+# лишние удаляются командой trim_timelines, которую запускают по расписанию
+TIMELINE_MAX_ENTRIES = 1000
+
+# Посты авторов, у которых подписчиков больше порога, не раскладываются
+# по лентам при публикации, а подмешиваются в ленту при чтении
+FANOUT_FOLLOWER_THRESHOLD = 10000
+
+# Кэш главной страницы сбрасывается сигналами при изменении постов,
+# поэтому его можно хранить долго
+INDEX_CACHE_TIMEOUT = 60 * 60 * 6
+# Общие страницы тоже сбрасываются сигналами точно по меткам
+PAGE_CACHE_TIMEOUT = 60 * 60 * 6
+# Защита от одновременного пересчета кэша: сколько после истечения
+# запись еще отдается, пока ее пересчитывают, на сколько выдается
+# аренда пересчета и сколько ждать результата, если записи нет совсем
+CACHE_STALE_TIMEOUT = 60 * 10
+CACHE_LEASE_TIMEOUT = 30
+CACHE_LEASE_WAIT = 2
+
+# Сколько соседних страниц показывать в навигации по обе стороны от текущей
+PAGINATOR_WINDOW = 2
+# Как долго хранится приблизительное число записей для навигации
+PAGINATOR_COUNT_TIMEOUT = 60 * 5
+
+# Варианты картинок постов для srcset: ширины, форматы и параметры
+# sorl-thumbnail. Высота считается по пропорции POST_IMAGE_RATIO,
+# последний формат — запасной для браузеров без поддержки остальных.
+# Все варианты готовятся в фоне сразу после загрузки картинки
+POST_IMAGE_WIDTHS = (320, 640, 960)
+POST_IMAGE_FORMATS = ("WEBP", "JPEG")
+POST_IMAGE_RATIO = (16, 10)
+POST_IMAGE_OPTIONS = {"crop": "center", "upscale": True}
+# Ширина картинки в макете для атрибута sizes
+POST_IMAGE_SIZES = "(max-width: 767px) 100vw, 730px"
+# Ограничения загружаемых картинок: размер файла и число пикселей
+# проверяются до декодирования, оригинал больше POST_IMAGE_MAX_SIDE
+# по длинной стороне уменьшается перед сохранением
+POST_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 40_000_000
+POST_IMAGE_MAX_SIDE = 2560
+POST_IMAGE_QUALITY = 90
+THUMBNAIL_WORKERS = 2
+# Хранилище ключей sorl-thumbnail с пакетным чтением через кэш
+THUMBNAIL_KVSTORE = "posts.kvstore.KVStore"
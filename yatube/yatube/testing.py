@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+def isolated_caches():
+    """Настройки кэшей для тестов: свой L2 в памяти процесса.
+
+    Иначе тесты пишут в каталог cache и очищают кэш запущенного
+    сервера.
+    """
+    caches = dict(settings.CACHES)
+    caches["shared"] = {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "yatube-tests",
+    }
+    return override_settings(CACHES=caches)
+
+
+class TestRunner(DiscoverRunner):
+    """DiscoverRunner, запускающий тесты с ``isolated_caches``."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.caches_override = isolated_caches()
+        self.caches_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.caches_override.disable()
+        super().teardown_test_environment(**kwargs)
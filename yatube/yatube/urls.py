@@ -19,6 +19,8 @@ from django.conf.urls import handler404, handler500  # noqa
 from django.conf import settings
 from django.conf.urls.static import static
 
+from . import views
+
 handler404 = "yatube.views.page_not_found"  # noqa
 handler500 = "yatube.views.server_error"  # noqa
 
@@ -26,6 +28,11 @@ urlpatterns = [
     path("auth/", include("users.urls")),
     path("auth/", include("django.contrib.auth.urls")),
     path("admin/", admin.site.urls),
+    path(
+        settings.MEDIA_URL.lstrip("/") + "<path:path>",
+        views.media,
+        name="media",
+    ),
     path("", include("posts.urls")),
     path("about/", include("about.urls", namespace="about")),
 ]
@@ -33,8 +40,6 @@ urlpatterns = [
 if settings.DEBUG:
     import debug_toolbar
 
-    urlpatterns += static(settings.MEDIA_URL,
-                          document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL,
                           document_root=settings.STATIC_ROOT)
     urlpatterns += (path("__debug__/", include(debug_toolbar.urls)),)
@@ -1,6 +1,23 @@
+import mimetypes
+import os
+import re
 from http import HTTPStatus
+from urllib.parse import quote
 
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
 from django.shortcuts import render
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+# Картинки постов и миниатюры sorl лежат под хэшем содержимого
+# в каталогах вида ``posts/ab/cd/<хэш>.jpg`` и никогда не меняются.
+HASHED_MEDIA = re.compile(
+    r"^[\w-]+/[0-9a-f]{2}/[0-9a-f]{2}/(?P<digest>[0-9a-f]{32,64})\.\w+$"
+)
 
 
 def page_not_found(request, exception):
@@ -18,3 +35,61 @@ def server_error(request):
         "misc/500.html",
         status=HTTPStatus.INTERNAL_SERVER_ERROR
     )
+
+
+def media_file_response(full_path, path):
+    """Ответ с содержимым файла или заголовком для фронтового прокси."""
+    if settings.MEDIA_ACCEL == "x-accel-redirect":
+        response = HttpResponse()
+        response["X-Accel-Redirect"] = quote(
+            settings.MEDIA_ACCEL_PREFIX + path
+        )
+    elif settings.MEDIA_ACCEL == "x-sendfile":
+        response = HttpResponse()
+        response["X-Sendfile"] = full_path
+    else:
+        response = FileResponse(open(full_path, "rb"))
+    content_type, encoding = mimetypes.guess_type(full_path)
+    response["Content-Type"] = content_type or "application/octet-stream"
+    if encoding:
+        response["Content-Encoding"] = encoding
+    return response
+
+
+@require_safe
+def media(request, path):
+    """Отдает файл из MEDIA_ROOT.
+
+    При MEDIA_ACCEL байты отдает фронтовой прокси по заголовку
+    X-Accel-Redirect (nginx) или X-Sendfile (Apache, lighttpd), а
+    Django только проверяет путь и ставит заголовки кэширования.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    hashed = HASHED_MEDIA.match(path)
+    if hashed:
+        etag = quote_etag(hashed.group("digest"))
+    else:
+        etag = quote_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+    if response is None:
+        response = media_file_response(full_path, path)
+        response["Last-Modified"] = http_date(stat.st_mtime)
+    response["ETag"] = etag
+    if hashed:
+        patch_cache_control(
+            response, public=True, max_age=60 * 60 * 24 * 365, immutable=True
+        )
+    else:
+        patch_cache_control(
+            response, public=True, max_age=settings.MEDIA_CACHE_TIMEOUT
+        )
+    return response